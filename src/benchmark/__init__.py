@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/11/23 20:41
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description: Local benchmarks, run from `src/` with `python -m benchmark.<name>`
+from .common import tree_rss, fmt_mb
+
+__all__ = ["tree_rss", "fmt_mb"]
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/11/23 20:41
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description: Launch latency and RSS per account, persistent context vs shared browser
+"""
+python -m benchmark.browser_pool --accounts 5 --url https://store.epicgames.com/en-US/free-games
+python -m benchmark.browser_pool --accounts 5 --save browser_pool.json
+
+--save keeps the summary of both modes together with the Firefox build and the host
+it ran on, numbers of different machines are not comparable without them.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from playwright.async_api import async_playwright
+
+from benchmark.common import tree_rss, fmt_mb
+
+ARGS = ["--hide-crash-restore-bubble"]
+
+
+async def bench_persistent(accounts: int, url: str | None) -> dict:
+    """One launch_persistent_context per account, the way ISurrender.stash runs by default"""
+    latencies: List[float] = []
+    rss: List[int] = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        async with async_playwright() as p:
+            baseline = tree_rss()
+            for i in range(accounts):
+                start = time.perf_counter()
+                context = await p.firefox.launch_persistent_context(
+                    user_data_dir=Path(tmp, f"account-{i}"), args=ARGS
+                )
+                page = context.pages[0]
+                latencies.append(time.perf_counter() - start)
+                if url:
+                    await page.goto(url, wait_until="domcontentloaded")
+                rss.append(tree_rss() - baseline)
+                await context.close()
+
+    return {"latencies": latencies, "rss": rss}
+
+
+async def bench_pool(accounts: int, url: str | None) -> dict:
+    """One browser, one isolated BrowserContext per account, all alive at the same time"""
+    latencies: List[float] = []
+    rss: List[int] = []
+
+    async with async_playwright() as p:
+        baseline = tree_rss()
+        start = time.perf_counter()
+        browser = await p.firefox.launch(args=ARGS)
+        cold_start = time.perf_counter() - start
+
+        contexts = []
+        for _ in range(accounts):
+            start = time.perf_counter()
+            context = await browser.new_context()
+            page = await context.new_page()
+            latencies.append(time.perf_counter() - start)
+            if url:
+                await page.goto(url, wait_until="domcontentloaded")
+            contexts.append(context)
+            rss.append((tree_rss() - baseline) / len(contexts))
+
+        for context in contexts:
+            await context.close()
+        version = browser.version
+        await browser.close()
+
+    return {"latencies": latencies, "rss": rss, "cold_start": cold_start, "firefox": version}
+
+
+def summarize(result: dict) -> dict:
+    summary = {
+        "launch_p50_ms": round(statistics.median(result["latencies"]) * 1000),
+        "launch_max_ms": round(max(result["latencies"]) * 1000),
+        "rss_per_account": round(statistics.mean(result["rss"])),
+    }
+    if "cold_start" in result:
+        summary["cold_start_ms"] = round(result["cold_start"] * 1000)
+    return summary
+
+
+def report(name: str, summary: dict):
+    print(
+        f"{name:<12}"
+        f" launch p50={summary['launch_p50_ms']}ms"
+        f" max={summary['launch_max_ms']}ms"
+        f" rss/account={fmt_mb(summary['rss_per_account'])}"
+        + (f" cold_start={summary['cold_start_ms']}ms" if "cold_start_ms" in summary else "")
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--accounts", type=int, default=5)
+    parser.add_argument("--url", type=str, default=None, help="page loaded in every context")
+    parser.add_argument("--save", type=Path, default=None, help="write the results as JSON")
+    args = parser.parse_args()
+
+    persistent = await bench_persistent(args.accounts, args.url)
+    pool = await bench_pool(args.accounts, args.url)
+    results = {"persistent": summarize(persistent), "pool": summarize(pool)}
+    for name, summary in results.items():
+        report(name, summary)
+
+    if args.save:
+        host = {
+            "firefox": pool["firefox"],
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        }
+        args.save.write_text(
+            json.dumps({"args": sys.argv[1:], "host": host, "results": results}, indent=2)
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/11/23 20:41
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description:
+from __future__ import annotations
+
+import os
+from contextlib import suppress
+from pathlib import Path
+from typing import Dict
+
+
+def _read_proc() -> Dict[int, tuple[int, int]]:
+    """pid -> (ppid, rss bytes), Linux only"""
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    table = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        with suppress(OSError, ValueError, IndexError):
+            stat = entry.joinpath("stat").read_text()
+            # comm may contain spaces, the remaining fields start after the last ')'
+            fields = stat[stat.rindex(")") + 2 :].split()
+            ppid = int(fields[1])
+            rss = int(entry.joinpath("statm").read_text().split()[1]) * page_size
+            table[int(entry.name)] = (ppid, rss)
+    return table
+
+
+def tree_rss(pid: int | None = None, *, include_self: bool = False) -> int:
+    """Resident memory of all descendants of `pid` (browser, content processes, driver)"""
+    pid = pid or os.getpid()
+    table = _read_proc()
+
+    children: Dict[int, list] = {}
+    for p, (ppid, _) in table.items():
+        children.setdefault(ppid, []).append(p)
+
+    total = table.get(pid, (0, 0))[1] if include_self else 0
+    stack = list(children.get(pid, []))
+    while stack:
+        p = stack.pop()
+        total += table.get(p, (0, 0))[1]
+        stack.extend(children.get(p, []))
+    return total
+
+
+def fmt_mb(n: int | float) -> str:
+    return f"{n / 1024 / 1024:.1f}MB"
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/12/1 20:15
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description: Waterfall analysis of the eg-*.har files recorded by the claim browser
+"""
+python -m benchmark.har ../user_data_dir/epic-games@alice/record
+python -m benchmark.har eg-1701360000.har eg-1701446400.har --compare
+python -m benchmark.har ../user_data_dir --by host --top 20 --gap-ms 500
+
+A directory stands for every eg-*.har below it, oldest first.
+
+The `entries` array is decoded one entry at a time, response bodies embedded by
+Playwright are dropped as soon as the entry is read, so a file of several hundred MB
+is analysed in memory bounded by about twice its largest entry.
+
+Every request is attributed to a claim stage by the document its page was showing
+(product page -> add-to-cart, cart and purchase iframe -> checkout, ...),
+requests to hCaptcha always count as `challenge`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import heapq
+import json
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+from urllib.parse import urlsplit
+
+from utils.routing import host_matches
+
+_ENTRIES = re.compile(r'(?<!\\)"entries"\s*:\s*\[')
+
+CHALLENGE_HOSTS = ("hcaptcha.com",)
+
+PURCHASE_HOSTS = ("payment-website-pci.ol.epicgames.com",)
+
+TIMING_PHASES = ("blocked", "dns", "connect", "ssl", "send", "wait", "receive")
+
+
+def iter_entries(fp: Path, chunk_size: int = 1024 * 1024) -> Iterator[dict]:
+    """Yield log.entries of a HAR file one by one, without reading the whole file"""
+    decoder = json.JSONDecoder()
+    with open(fp, encoding="utf8") as f:
+        buf = ""
+        while not (m := _ENTRIES.search(buf)):
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            # Keep a tail, the key may straddle two chunks
+            buf = buf[-64:] + chunk
+        buf = buf[m.end() :]
+
+        while True:
+            buf = buf.lstrip(", \t\r\n")
+            if buf.startswith("]"):
+                return
+            try:
+                if not buf:
+                    raise JSONDecodeError("Need more data", buf, 0)
+                entry, end = decoder.raw_decode(buf)
+            except JSONDecodeError:
+                # Decode again only once the buffer has doubled, an entry of n bytes then
+                # costs O(n) in total instead of one pass from its start per chunk
+                chunk = f.read(max(len(buf), chunk_size))
+                if not chunk:
+                    return
+                buf += chunk
+                continue
+            buf = buf[end:]
+            yield entry
+
+
+def resource_type(entry: dict) -> str:
+    """Playwright's own resource type if present, otherwise guessed from the MIME type"""
+    if rt := entry.get("_resourceType"):
+        return rt
+    mime = (entry.get("response", {}).get("content", {}).get("mimeType") or "").lower()
+    for needle, rt in [
+        ("html", "document"),
+        ("javascript", "script"),
+        ("ecmascript", "script"),
+        ("css", "stylesheet"),
+        ("font", "font"),
+        ("image", "image"),
+        ("json", "fetch"),
+        ("video", "media"),
+        ("audio", "media"),
+    ]:
+        if needle in mime:
+            return rt
+    return "other"
+
+
+def document_stage(host: str, path: str) -> str | None:
+    """Claim stage of a page showing host/path, None for documents that do not move it"""
+    if host_matches(host, PURCHASE_HOSTS) or path.startswith(("/en-US/cart", "/en-US/download")):
+        return "checkout"
+    if "/p/" in path:
+        return "add-to-cart"
+    if "/bundles/" in path:
+        return "claim-bundle"
+    if path.startswith("/id/") or path.startswith(("/account/personal", "/en-US/free-games")):
+        return "authorize"
+    if path.startswith("/account/creator-programs"):
+        return "prelude"
+    if host_matches(host, CHALLENGE_HOSTS):
+        return
+    return "other"
+
+
+def _parse_time(value: str) -> float:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+@dataclass
+class Request:
+    """What is kept of an entry once its body is dropped"""
+
+    start: float
+    time: float
+    url: str
+    host: str
+    path: str
+    method: str
+    status: int
+    type: str
+    size: int
+    page: str
+    timings: Dict[str, float]
+    stage: str = "other"
+
+    @property
+    def end(self) -> float:
+        return self.start + self.time / 1000
+
+    @classmethod
+    def from_entry(cls, entry: dict) -> Request:
+        request, response = entry["request"], entry.get("response", {})
+        url = urlsplit(request["url"])
+        size = response.get("_transferSize", -1)
+        if size is None or size < 0:
+            size = max(response.get("bodySize", 0), response.get("content", {}).get("size", 0))
+        return cls(
+            start=_parse_time(entry["startedDateTime"]),
+            time=max(entry.get("time") or 0, 0),
+            url=request["url"][:160],
+            host=url.hostname or "",
+            path=url.path,
+            method=request.get("method", "GET"),
+            status=response.get("status", 0),
+            type=resource_type(entry),
+            size=max(size, 0),
+            page=entry.get("pageref", ""),
+            timings={
+                k: v for k in TIMING_PHASES if (v := (entry.get("timings") or {}).get(k, -1)) > 0
+            },
+        )
+
+
+@dataclass
+class Bucket:
+    count: int = 0
+    time: float = 0
+    size: int = 0
+    wait: float = 0
+    blocked: float = 0
+
+    def add(self, r: Request):
+        self.count += 1
+        self.time += r.time
+        self.size += r.size
+        self.wait += r.timings.get("wait", 0)
+        self.blocked += r.timings.get("blocked", 0)
+
+
+@dataclass
+class Waterfall:
+    """Aggregates of one HAR file"""
+
+    path: Path
+    requests: List[Request] = field(default_factory=list)
+    skipped: int = 0
+
+    @classmethod
+    def from_file(cls, fp: Path) -> Waterfall:
+        waterfall = cls(path=fp)
+        for entry in iter_entries(fp):
+            try:
+                waterfall.requests.append(Request.from_entry(entry))
+            except (KeyError, TypeError, ValueError):
+                waterfall.skipped += 1
+        waterfall.requests.sort(key=lambda r: r.start)
+        waterfall._assign_stages()
+        return waterfall
+
+    def _assign_stages(self):
+        current: Dict[str, str] = {}
+        for r in self.requests:
+            if host_matches(r.host, CHALLENGE_HOSTS):
+                r.stage = "challenge"
+                continue
+            if r.type == "document" and (stage := document_stage(r.host, r.path)):
+                current[r.page] = stage
+            r.stage = current.get(r.page, "other")
+
+    @property
+    def duration(self) -> float:
+        if not self.requests:
+            return 0
+        return max(r.end for r in self.requests) - self.requests[0].start
+
+    def breakdown(self, key: str) -> Dict[str, Bucket]:
+        buckets: Dict[str, Bucket] = defaultdict(Bucket)
+        for r in self.requests:
+            buckets[getattr(r, key)].add(r)
+        return dict(sorted(buckets.items(), key=lambda kv: kv[1].time, reverse=True))
+
+    def slowest(self, n: int) -> List[Request]:
+        return heapq.nlargest(n, self.requests, key=lambda r: r.time)
+
+    def gaps(self, min_gap: float) -> List[Tuple[float, Request, Request]]:
+        """
+        Stretches of at least `min_gap` seconds with no request in flight
+
+        On the claim path these are the client waiting, e.g. a selector timeout,
+        rather than the network.
+        """
+        gaps = []
+        busy_until, last = None, None
+        for r in self.requests:
+            if busy_until is not None and r.start - busy_until >= min_gap:
+                gaps.append((r.start - busy_until, last, r))
+            if busy_until is None or r.end > busy_until:
+                busy_until, last = r.end, r
+        return sorted(gaps, key=lambda g: g[0], reverse=True)
+
+
+def _fmt_size(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f}MB" if size >= 1024 * 1024 else f"{size / 1024:.0f}KB"
+
+
+def report(waterfall: Waterfall, by: List[str], top: int, min_gap: float):
+    total = sum(r.time for r in waterfall.requests) or 1
+    print(
+        f"\n{waterfall.path}"
+        f" requests={len(waterfall.requests)}"
+        f" span={waterfall.duration:.1f}s"
+        f" transferred={_fmt_size(sum(r.size for r in waterfall.requests))}"
+        + (f" skipped={waterfall.skipped}" if waterfall.skipped else "")
+    )
+
+    for key in by:
+        print(
+            f"\n  {'by ' + key:<36} {'count':>6} {'time':>9} {'share':>6}"
+            f" {'wait':>9} {'blocked':>9} {'size':>8}"
+        )
+        for name, b in list(waterfall.breakdown(key).items())[:top]:
+            print(
+                f"  {name[:36]:<36} {b.count:>6} {b.time / 1000:>8.2f}s {b.time / total:>6.0%}"
+                f" {b.wait / 1000:>8.2f}s {b.blocked / 1000:>8.2f}s {_fmt_size(b.size):>8}"
+            )
+
+    print("\n  slowest requests")
+    for r in waterfall.slowest(top):
+        phase = max(r.timings, key=r.timings.get) if r.timings else "-"
+        print(
+            f"  {r.time / 1000:>7.2f}s {r.stage:<13} {r.type:<10} {r.status:>3} {phase:<8} {r.url}"
+        )
+
+    if gaps := waterfall.gaps(min_gap):
+        print(f"\n  idle gaps >= {min_gap:.1f}s, {sum(g[0] for g in gaps):.1f}s in total")
+        for gap, before, after in gaps[:top]:
+            print(f"  {gap:>7.2f}s {after.stage:<13} after {before.url}")
+            print(f"  {'':>7}  {'':<13} until {after.url}")
+
+
+def compare(waterfalls: List[Waterfall], key: str, top: int):
+    """Total time per `key` for every run, the last column is the change from the first run"""
+    rows: Dict[str, List[float]] = defaultdict(lambda: [0.0] * len(waterfalls))
+    for i, w in enumerate(waterfalls):
+        for name, b in w.breakdown(key).items():
+            rows[name][i] = b.time / 1000
+    ordered = sorted(rows.items(), key=lambda kv: max(kv[1]), reverse=True)[:top]
+
+    print(
+        f"\ncompare by {key}: " + ", ".join(f"#{i} {w.path.name}" for i, w in enumerate(waterfalls))
+    )
+    print(
+        f"  {'':<36}" + "".join(f" {f'#{i}':>9}" for i in range(len(waterfalls))) + f" {'delta':>9}"
+    )
+    for name, times in ordered:
+        delta = times[-1] - times[0]
+        print(f"  {name[:36]:<36}" + "".join(f" {t:>8.2f}s" for t in times) + f" {delta:>+8.2f}s")
+    spans = [w.duration for w in waterfalls]
+    print(
+        f"  {'span':<36}"
+        + "".join(f" {s:>8.2f}s" for s in spans)
+        + f" {spans[-1] - spans[0]:>+8.2f}s"
+    )
+
+
+def collect(paths: List[Path]) -> List[Path]:
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(sorted(path.rglob("eg-*.har"), key=lambda fp: fp.stat().st_mtime))
+        elif path.is_file():
+            files.append(path)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("paths", type=Path, nargs="+", help="HAR files or record dirs")
+    parser.add_argument(
+        "--by",
+        type=str,
+        default="stage,host,type",
+        help="comma separated breakdowns: stage, host, type",
+    )
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--gap-ms", type=int, default=1000, help="smallest idle gap reported")
+    parser.add_argument("--compare", action="store_true", help="compare the runs side by side")
+    args = parser.parse_args()
+
+    by = [k.strip() for k in args.by.split(",") if k.strip() in ("stage", "host", "type")]
+    files = collect(args.paths)
+    if not files:
+        parser.error("no HAR file found")
+
+    waterfalls = []
+    for fp in files:
+        waterfall = Waterfall.from_file(fp)
+        report(waterfall, by, args.top, args.gap_ms / 1000)
+        waterfalls.append(waterfall)
+
+    if args.compare and len(waterfalls) > 1:
+        for key in by:
+            compare(waterfalls, key, args.top)
+
+
+if __name__ == "__main__":
+    main()
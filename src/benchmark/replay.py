@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/11/30 21:08
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description: End-to-end claim latency and throughput against a local stand-in of Epic
+"""
+python -m benchmark.replay --accounts 4
+python -m benchmark.replay --accounts 4 --tabs 2 --block-profile lean --save after.json --compare before.json
+
+Each round n = 1..N claims the weekly promotions for n fresh accounts through
+ISurrender.stash on one shared browser, exactly like `run()` with browser_pool.
+Nothing leaves the machine:
+
+- HTTP and browser traffic to *.epicgames.com is answered by `benchmark.standin`
+- AgentG is replaced by `StubSolver`, which "solves" every challenge after --solve-ms
+- Models are never loaded, config.json and user_data_dir are not touched
+
+Fixed waits of the pipeline (pre-page, license and UK confirm timeouts) are kept,
+they are part of what a change to the hot path should be measured against.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Any, TYPE_CHECKING
+
+from loguru import logger
+
+import claim
+import epic_games.api
+from benchmark.standin import StandIn, StandInTransport, apply_standin, SESSION_COOKIE
+from claim import ISurrender
+from epic_games import EpicPlayer
+from epic_games.store import StateStore, set_store
+from settings import Config, set_config, project
+from utils import set_transport, aclose_client, limiter
+from utils.metrics import metrics, percentile
+
+if TYPE_CHECKING:
+    # Only the rounds drive a browser, the stand-in and the players work without Playwright
+    from playwright.async_api import Browser, BrowserContext
+
+ARGS = ["--hide-crash-restore-bubble"]
+
+STAGES = ["preflight", "launch", "add-to-cart", "checkout", "insert-challenge", "stash"]
+
+
+class StubStatus:
+    CHALLENGE_SUCCESS = "success"
+    CHALLENGE_BACKCALL = "backcall"
+    CHALLENGE_RETRY = "retry"
+
+
+@dataclass
+class StubSolver:
+    """Drop-in for AgentG, every challenge is passed after `solve_time` seconds"""
+
+    page: Any
+    modelhub = None
+    status = StubStatus
+    qr_queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+
+    solve_time = 0.0
+
+    @classmethod
+    def from_page(cls, page, **kwargs):
+        return cls(page=page)
+
+    async def execute(self, **kwargs):
+        await asyncio.sleep(self.solve_time)
+        return self.status.CHALLENGE_SUCCESS
+
+
+class StubModelCache:
+    async def aensure(self):
+        return None
+
+
+@dataclass
+class ReplaySurrender(ISurrender):
+    standin_url: str = ""
+
+    async def new_context(self, browser: Browser) -> BrowserContext:
+        context = await super().new_context(browser)
+        await apply_standin(context, self.standin_url)
+        return context
+
+
+def new_player(root: Path, i: int) -> EpicPlayer:
+    """A signed-in account, the session is what a previous login would have left"""
+    player = EpicPlayer(email=f"bench{i}@local", password="", mode="epic-games", user_data_dir=root)
+    cookies = [
+        {
+            "name": name,
+            "value": f"bench-{i}",
+            "domain": ".epicgames.com",
+            "path": "/",
+            "expires": time.time() + 86400 * 30,
+            "httpOnly": True,
+            "secure": True,
+            "sameSite": "None",
+        }
+        for name in [SESSION_COOKIE, "EPIC_BEARER_TOKEN"]
+    ]
+    player.save_state({"cookies": cookies, "origins": []})
+    return player
+
+
+async def bench_round(
+    browser: Browser, standin: StandIn, accounts: int, concurrency: int
+) -> Dict[str, Any]:
+    """Claim for `accounts` fresh players, at most `concurrency` at the same time"""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        # Every round starts cold, the shared caches are rebuilt under the scratch dir
+        project.assets_dir = root.joinpath("assets")
+        claim._asset_cache = None
+        set_store(StateStore(path=root.joinpath("state.db")))
+        epic_games.api.promotions_cache = epic_games.api.PromotionsCache()
+        players = [new_player(root, i) for i in range(accounts)]
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        metrics.reset()
+        limiter.reset()
+        standin.hits.clear()
+
+        async def _stash(player: EpicPlayer) -> Dict[str, Any]:
+            async with semaphore:
+                with logger.contextualize(account=player.namespace):
+                    agent = ReplaySurrender(player=player, browser=browser, standin_url=standin.url)
+                    start = time.perf_counter()
+                    with metrics.span("stash"):
+                        success = bool(await agent.stash())
+                    return {"success": success, "elapsed": time.perf_counter() - start}
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[_stash(p) for p in players])
+        wall = time.perf_counter() - start
+        set_store(None)
+
+    latencies = [r["elapsed"] for r in results]
+    return {
+        "accounts": accounts,
+        "concurrency": concurrency,
+        "success": sum(r["success"] for r in results),
+        "wall": round(wall, 3),
+        "p50": round(percentile(latencies, 0.5), 3),
+        "p95": round(percentile(latencies, 0.95), 3),
+        "throughput": round(accounts / wall * 60, 2),
+        "requests": sum(standin.hits.values()),
+        "stages": metrics.summary(),
+        "limits": limiter.stats(),
+    }
+
+
+def report(result: Dict[str, Any], baseline: Dict[str, Any] | None = None):
+    def delta(key: str) -> str:
+        if not baseline or not baseline.get(key):
+            return ""
+        return f"({(result[key] - baseline[key]) / baseline[key]:+.0%})"
+
+    print(
+        f"accounts={result['accounts']:<3}"
+        f" ok={result['success']}/{result['accounts']}"
+        f" wall={result['wall']:.2f}s{delta('wall')}"
+        f" p50={result['p50']:.2f}s{delta('p50')}"
+        f" p95={result['p95']:.2f}s{delta('p95')}"
+        f" throughput={result['throughput']:.1f}/min{delta('throughput')}"
+        f" requests={result['requests']}"
+    )
+    stages = result["stages"]
+    print("  " + " ".join(f"{s}={stages[s]['p50']:.2f}s" for s in STAGES if s in stages) + " (p50)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--accounts", type=int, default=3, help="rounds of 1..N accounts")
+    parser.add_argument("--concurrency", type=int, default=0, help="0 for all accounts at once")
+    parser.add_argument("--tabs", type=int, default=1, help="config.max_tabs")
+    parser.add_argument("--block-profile", type=str, default="off")
+    parser.add_argument("--asset-cache", type=int, default=0, help="config.asset_cache_size, MB")
+    parser.add_argument("--latency-ms", type=int, default=0, help="added to every response")
+    parser.add_argument("--solve-ms", type=int, default=0, help="time the stub solver takes")
+    parser.add_argument("--headful", action="store_true")
+    parser.add_argument("--save", type=Path, default=None, help="write the results as JSON")
+    parser.add_argument("--compare", type=Path, default=None, help="results of a previous --save")
+    parser.add_argument("--log-level", type=str, default="WARNING")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    import epic_games.agent
+    from playwright.async_api import async_playwright
+
+    set_config(
+        Config(
+            epic_email="bench0@local",
+            epic_password="",
+            max_tabs=max(1, args.tabs),
+            block_profile=args.block_profile,
+            asset_cache_size=max(0, args.asset_cache),
+            record_mode="off",
+            model_offline=True,
+            browser_pool=True,
+        )
+    )
+    epic_games.agent.AgentG = StubSolver
+    StubSolver.solve_time = args.solve_ms / 1000
+    claim.get_model_cache = StubModelCache
+
+    baseline = {}
+    if args.compare:
+        baseline = {r["accounts"]: r for r in json.loads(args.compare.read_text())["rounds"]}
+
+    rounds = []
+    with StandIn(latency=args.latency_ms / 1000) as standin:
+        set_transport(StandInTransport(standin.url))
+        try:
+            async with async_playwright() as p:
+                browser = await p.firefox.launch(headless=not args.headful, args=ARGS)
+                for n in range(1, args.accounts + 1):
+                    result = await bench_round(browser, standin, n, args.concurrency or n)
+                    report(result, baseline.get(n))
+                    rounds.append(result)
+                await browser.close()
+        finally:
+            await aclose_client()
+            set_transport(None)
+
+    if args.save:
+        args.save.write_text(json.dumps({"args": sys.argv[1:], "rounds": rounds}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/11/30 21:08
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description: Local stand-in of the Epic endpoints used by the claim pipeline
+"""
+Every request the pipeline makes to *.epicgames.com is answered from `fixtures/`:
+
+- freeGamesPromotions, ajaxGetOrderHistory, account/personal and the GraphQL
+  searchStoreQuery over the shared AsyncClient, through `StandInTransport`
+- product, cart, checkout iframe and success pages in the browser, through
+  `apply_standin` on the BrowserContext, the page keeps its store URL
+- immutable store bundles and key images, so the asset cache and block profiles
+  see the same kind of traffic as on the live store
+
+Cookies are checked for presence only, any EPIC_SESSION_AP passes.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from string import Template
+from typing import Dict, Any, Tuple, TYPE_CHECKING
+from urllib.parse import urlsplit
+
+import httpx
+
+if TYPE_CHECKING:
+    from playwright.async_api import BrowserContext, Route
+
+FIXTURES_DIR = Path(__file__).parent.joinpath("fixtures")
+
+SESSION_COOKIE = "EPIC_SESSION_AP"
+
+# 1x1 transparent GIF standing in for key images
+PIXEL = bytes.fromhex(
+    "47494638396101000100800000000000ffffff21f90401000000002c000000000100010000020144003b"
+)
+
+STORE_JS = b"/* store bundle */" + b" " * 64 * 1024
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _iso(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def load_promotions(now: datetime | None = None) -> Dict[str, Any]:
+    """freeGamesPromotions fixture with the offer windows moved around `now`"""
+    now = now or datetime.now(timezone.utc)
+    current = (now - timedelta(days=1), now + timedelta(days=6))
+    upcoming = (current[1], current[1] + timedelta(days=7))
+
+    data = json.loads(FIXTURES_DIR.joinpath("freeGamesPromotions.json").read_text(encoding="utf8"))
+    for e in data["data"]["Catalog"]["searchStore"]["elements"]:
+        for key, (start, end) in [
+            ("promotionalOffers", current),
+            ("upcomingPromotionalOffers", upcoming),
+        ]:
+            for group in e["promotions"][key]:
+                for offer in group["promotionalOffers"]:
+                    offer["startDate"], offer["endDate"] = _iso(start), _iso(end)
+    return data
+
+
+class StandIn:
+    """
+    Threaded HTTP server on 127.0.0.1
+
+    Args:
+        latency: Seconds added to every response, a rough stand-in for the network
+        hydrate: Seconds before the add-to-cart button of a product page is enabled
+        rerender: Seconds the cart takes to re-render after a move to the wishlist
+    """
+
+    def __init__(self, latency: float = 0.0, hydrate: float = 0.3, rerender: float = 0.5):
+        self.latency = latency
+        self.hits: Counter = Counter()
+        self._lock = threading.Lock()
+
+        promotions = load_promotions()
+        self._promotions = json.dumps(promotions).encode()
+        self._promotions_etag = f'"{hashlib.md5(self._promotions).hexdigest()}"'
+        self._order_history = FIXTURES_DIR.joinpath("ajaxGetOrderHistory.json").read_bytes()
+        self._search_store = FIXTURES_DIR.joinpath("searchStoreQuery.json").read_bytes()
+
+        product = Template(FIXTURES_DIR.joinpath("product.html").read_text(encoding="utf8"))
+        self._products: Dict[str, bytes] = {}
+        for e in promotions["data"]["Catalog"]["searchStore"]["elements"]:
+            slug = e["catalogNs"]["mappings"][0]["pageSlug"]
+            self._products[slug] = product.substitute(
+                title=e["title"],
+                id=e["id"],
+                namespace=e["namespace"],
+                thumbnail=e["keyImages"][-1]["url"],
+                hydrate_ms=int(hydrate * 1000),
+            ).encode()
+
+        cart = Template(FIXTURES_DIR.joinpath("cart.html").read_text(encoding="utf8"))
+        self._cart = cart.substitute(rerender_ms=int(rerender * 1000)).encode()
+        self._purchase = FIXTURES_DIR.joinpath("purchase.html").read_bytes()
+        self._success = FIXTURES_DIR.joinpath("success.html").read_bytes()
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> StandIn:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def respond(self, method: str, path: str, headers: Dict[str, str]) -> Tuple[int, Dict, bytes]:
+        """(status, headers, body) of one request, keyed by path only"""
+        signed_in = f"{SESSION_COOKIE}=" in headers.get("cookie", "")
+        json_type = {"content-type": "application/json; charset=utf-8"}
+        html_type = {"content-type": "text/html; charset=utf-8", "cache-control": "no-store"}
+
+        if path == "/freeGamesPromotions":
+            tag = {"etag": self._promotions_etag, "cache-control": "public, max-age=300"}
+            if headers.get("if-none-match") == self._promotions_etag:
+                return 304, tag, b""
+            return 200, {**json_type, **tag}, self._promotions
+        if path == "/graphql":
+            return 200, json_type, self._search_store
+        if path == "/account/v2/payment/ajaxGetOrderHistory":
+            if not signed_in:
+                return 401, json_type, b'{"errorCode": "errors.com.epicgames.unauthorized"}'
+            return 200, json_type, self._order_history
+        if path in ("/account/personal", "/account/creator-programs"):
+            if not signed_in:
+                return 302, {"location": "https://www.epicgames.com/id/login"}, b""
+            return 200, html_type, b"<html><body>account</body></html>"
+        if path.startswith("/en-US/p/"):
+            if body := self._products.get(path.removeprefix("/en-US/p/").strip("/")):
+                return 200, html_type, body
+        if path == "/en-US/cart":
+            return 200, html_type, self._cart
+        if path == "/en-US/cart/success":
+            return 200, html_type, self._success
+        if path == "/purchase":
+            return 200, html_type, self._purchase
+        if method == "POST" and path in ("/cart/add", "/purchase/confirm"):
+            return (200 if signed_in else 401), json_type, b"{}"
+        if path.endswith(".js"):
+            return 200, {"content-type": "text/javascript", "cache-control": IMMUTABLE}, STORE_JS
+        if path.endswith((".jpg", ".png")):
+            return 200, {"content-type": "image/gif", "cache-control": IMMUTABLE}, PIXEL
+
+        return 404, json_type, b"{}"
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _serve(self):
+                if length := int(self.headers.get("content-length") or 0):
+                    self.rfile.read(length)
+                path = urlsplit(self.path).path
+                with standin._lock:
+                    standin.hits[path] += 1
+                if standin.latency:
+                    time.sleep(standin.latency)
+
+                headers = {k.lower(): v for k, v in self.headers.items()}
+                status, resp_headers, body = standin.respond(self.command, path, headers)
+                self.send_response(status)
+                for k, v in resp_headers.items():
+                    self.send_header(k, v)
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = _serve
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class StandInTransport(httpx.AsyncBaseTransport):
+    """Send every request of the AsyncClient to the stand-in, path and query unchanged"""
+
+    def __init__(self, base_url: str):
+        self._base = httpx.URL(base_url)
+        self._transport = httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(
+            scheme=self._base.scheme, host=self._base.host, port=self._base.port
+        )
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+async def apply_standin(context: BrowserContext, base_url: str):
+    """
+    Answer the Epic requests of the context from the stand-in, abort everything else
+
+    Registered before the asset cache and the block profile, so it runs last and
+    only sees the requests they let through.
+    """
+
+    async def handle(route: Route):
+        request = route.request
+        url = urlsplit(request.url)
+        if not (url.hostname or "").endswith("epicgames.com"):
+            return await route.abort()
+
+        headers = {k: v for k, v in (await request.all_headers()).items() if k != "host"}
+        response = await route.fetch(
+            url=f"{base_url}{url.path}" + (f"?{url.query}" if url.query else ""),
+            headers=headers,
+            max_redirects=0,
+        )
+        await route.fulfill(response=response)
+
+    await context.route("**/*", handle)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/11/25 17:20
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description: Time-to-first-decision and peak RSS of a fresh `claim` process
+"""
+python -m benchmark.startup --repeat 5
+python -m benchmark.startup --live    # real preflight with the account in config.json
+
+Each round spawns a new interpreter, imports `claim` and runs ISurrender.preflight
+until it decides whether the browser is needed. Without --live the player has no
+cookies and the state store is seeded with a fresh promotions entry of the stand-in
+fixture, so the decision is taken without touching the network.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmark.common import fmt_mb
+from benchmark.standin import load_promotions
+from epic_games.store import StateStore
+
+SRC_DIR = Path(__file__).parent.parent
+
+HEAVY_MODULES = ["playwright", "hcaptcha_challenger", "importlib_metadata", "epic_games.agent"]
+
+CHILD = """
+import asyncio, json, resource, sys, time
+from pathlib import Path
+
+t0 = time.perf_counter()
+import claim
+from epic_games import EpicPlayer
+from epic_games.store import StateStore, set_store
+t_import = time.perf_counter() - t0
+
+async def decide():
+    if {live}:
+        player = EpicPlayer.from_account()
+    else:
+        tmp = Path({scratch!r})
+        set_store(StateStore(path=tmp.joinpath("state.db")))
+        player = EpicPlayer(
+            email="bench@local", password="", mode="epic-games", user_data_dir=tmp,
+        )
+    agent = claim.ISurrender(player=player)
+    try:
+        return await agent.preflight()
+    finally:
+        await claim.aclose_client()
+
+decision = asyncio.run(decide())
+print(json.dumps({{
+    "import": t_import,
+    "decision": time.perf_counter() - t0,
+    "skip_browser": decision is not None,
+    "maxrss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    "heavy": [m for m in {heavy} if m in sys.modules],
+}}))
+"""
+
+
+def seed(scratch: Path):
+    """A promotions entry that is still fresh, the preflight then never fetches the feed"""
+    store = StateStore(path=scratch.joinpath("state.db"))
+    store.put_entry(
+        "freeGamesPromotions", {"data": load_promotions(), "expires_at": time.time() + 3600}
+    )
+    store.close()
+
+
+def measure(live: bool) -> dict:
+    with tempfile.TemporaryDirectory() as scratch:
+        if not live:
+            seed(Path(scratch))
+        code = CHILD.format(live=live, heavy=HEAVY_MODULES, scratch=scratch)
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-c", code], cwd=SRC_DIR, capture_output=True, text=True, check=True
+        )
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        result["process"] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--live", action="store_true")
+    parser.add_argument(
+        "--budget-ms", type=float, default=0, help="exit 1 if p50 time-to-first-decision is above"
+    )
+    args = parser.parse_args()
+
+    rounds = [measure(args.live) for _ in range(args.repeat)]
+    decision = statistics.median(r["decision"] for r in rounds) * 1000
+    process = statistics.median(r["process"] for r in rounds) * 1000
+    imports = statistics.median(r["import"] for r in rounds) * 1000
+    maxrss = max(r["maxrss"] for r in rounds)
+    heavy = sorted({m for r in rounds for m in r["heavy"]})
+
+    print(
+        f"import p50={imports:.0f}ms"
+        f" first-decision p50={decision:.0f}ms"
+        f" process p50={process:.0f}ms"
+        f" peak-rss={fmt_mb(maxrss)}"
+        f" skip-browser={rounds[-1]['skip_browser']}"
+        f" heavy-modules={heavy or '-'}"
+    )
+
+    if args.budget_ms and decision > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,27 +7,76 @@ from __future__ import annotations
 
 import asyncio
 import os
+import shutil
 import sys
+import tempfile
+import time
+from contextlib import contextmanager
 from dataclasses import dataclass, field
-from typing import List
+from pathlib import Path
+from typing import List, Set, Dict, TYPE_CHECKING
 
-import importlib_metadata
-from hcaptcha_challenger import install
-from hcaptcha_challenger.agents import Malenia
 from loguru import logger
-from playwright.async_api import BrowserContext, async_playwright
 
+from settings import get_config, init_logger, project
 from epic_games import (
     EpicPlayer,
-    EpicGames,
     Game,
-    CompletedOrder,
-    get_promotions,
-    get_order_history,
+    aget_promotions,
+    sync_order_history,
 )
+from epic_games.journal import ClaimJournal
+from epic_games.player import SessionStatus
+from epic_games.session import validate_sessions, session_expiry
+from epic_games.store import get_store
+from utils import aclose_client, limiter
+from utils.assets import AssetCache, apply_asset_cache
+from utils.metrics import metrics
+from utils.models import ModelCache
+from utils.routing import BlockProfile, apply_block_profile
+
+if TYPE_CHECKING:
+    # Playwright and hcaptcha-challenger are imported on the browser path only,
+    # a run that ends in the preflight never pays for them
+    from playwright.async_api import Browser, BrowserContext
 
 self_supervised = True
 
+_model_cache: ModelCache | None = None
+
+
+_asset_cache: AssetCache | None = None
+
+
+def get_asset_cache() -> AssetCache | None:
+    """One AssetCache per process, None when it is disabled"""
+    global _asset_cache
+    if _asset_cache is None and get_config().asset_cache_size:
+        _asset_cache = AssetCache(
+            root=project.assets_dir, max_bytes=get_config().asset_cache_size * 1024 * 1024
+        )
+    return _asset_cache
+
+
+def get_model_cache() -> ModelCache:
+    """One ModelCache per process, every account shares the loaded models"""
+    global _model_cache
+    if _model_cache is None:
+        config = get_config()
+        _model_cache = ModelCache(
+            root=project.models_dir,
+            refresh_interval=config.model_refresh_interval,
+            offline=config.model_offline,
+        )
+    return _model_cache
+
+
+@dataclass
+class ClaimResult:
+    account: str
+    success: bool
+    elapsed: float
+
 
 @dataclass
 class ISurrender:
@@ -38,13 +87,25 @@ class ISurrender:
     headless: bool = True
     locale: str = "en-US"
 
-    _orders = None
+    browser: Browser | None = None
+    """
+    Shared browser process, each player then gets an isolated BrowserContext
+    instead of its own persistent Firefox launch
+    """
+
+    session: SessionStatus | None = None
+    """
+    Status of the stored session if a batch validation already asked for it,
+    an expired session goes straight to the login instead of the prelude page
+    """
+
     _namespaces = None
     _pros = None
+    _record_scratch = None
+    _journal = None
 
     def __post_init__(self):
-        self._orders: List[CompletedOrder] = []
-        self._namespaces: List[str] = []
+        self._namespaces: Set[str] = set()
         self._pros: List[Game] = []
 
     @classmethod
@@ -55,17 +116,80 @@ class ISurrender:
     def cookies(self):
         return self.player.cookies
 
-    def create_tasks(self):
-        if not self._orders:
-            self._orders = get_order_history(self.cookies)
+    async def create_tasks(self) -> bool:
+        """
+        Returns: False if the promotions feed failed, `promotions` is then unknown
+            and must not be taken for "nothing left to claim"
+
+        """
+        # The two requests are independent, let them overlap
+        library, pros = await asyncio.gather(
+            sync_order_history(self.player) if not self._namespaces else asyncio.sleep(0),
+            aget_promotions() if not self._pros else asyncio.sleep(0),
+        )
         if not self._namespaces:
-            self._namespaces = [order.namespace for order in self._orders]
+            self._namespaces = library.namespaces
         if not self._pros:
-            self._pros = get_promotions()
+            if pros is None:
+                return False
+            self._pros = pros
             for pro in self._pros:
                 logger.debug("Put task", title=pro.title, url=pro.url)
 
-        self.promotions = [p for p in self._pros if p.namespace not in self._namespaces]
+        done = self._journal.done() if self._journal else set()
+        if self._journal and (
+            owned := [p for p in self._pros if p.namespace in self._namespaces - done]
+        ):
+            await self._journal.arecord("owned", owned)
+        self.promotions = [p for p in self._pros if p.namespace not in self._namespaces | done]
+        return True
+
+    async def resume(self) -> bool | None:
+        """
+        Pick up the claim journal of the current promotion window
+
+        Returns: True if a previous run already finished every promotion of the window
+
+        """
+        pros = await aget_promotions()
+        if not pros:
+            return
+        self._journal = ClaimJournal.for_promotions(self.player.namespace, pros)
+        done = self._journal.done()
+        if done >= {p.namespace for p in pros}:
+            logger.success(
+                "Pass claim task", reason="The window is done in the journal", stage="journal"
+            )
+            return True
+        if steps := self._journal.steps():
+            logger.info("Resume claim", window=self._journal.window, steps=steps)
+
+    async def preflight(self) -> bool | None:
+        """
+        Find out over plain HTTP whether the browser is needed at all
+
+        Returns: True if every promotion is already in the library, False if the
+            promotions feed failed and the account cannot be claimed now,
+            None if the browser has to decide
+
+        """
+        if await self.resume():
+            return True
+        if self.session is None:
+            self.session = await self.player.ctx_cookies.acheck()
+        if self.session != "valid":
+            return
+
+        self.ctx_cookies_is_available = True
+        if not await self.create_tasks():
+            logger.error("Exit task", reason="Failed to get promotions", stage="preflight")
+            return False
+
+        if not self.promotions:
+            logger.success(
+                "Pass claim task", reason="All free games are in my library", stage="preflight"
+            )
+            return True
 
     async def prelude_with_context(self, context: BrowserContext) -> bool | None:
         url = "https://www.epicgames.com/account/creator-programs"
@@ -75,11 +199,11 @@ class ISurrender:
             return
 
         self.ctx_cookies_is_available = True
-        await context.storage_state(path=self.player.ctx_cookie_path)
-        cookies = self.player.ctx_cookies.reload(self.player.ctx_cookie_path)
-        self.player.cookies = cookies
+        await self.player.asave_state(await context.storage_state())
 
-        self.create_tasks()
+        # A failed feed is left to claim_epic_games
+        if not await self.create_tasks():
+            return
 
         if not self.promotions:
             logger.success(
@@ -89,26 +213,40 @@ class ISurrender:
             )
             return True
 
-    async def claim_epic_games(self, context: BrowserContext):
+    async def claim_epic_games(self, context: BrowserContext, modelhub=None) -> bool | None:
+        from epic_games import EpicGames
+
         page = context.pages[0]
-        epic = EpicGames.from_player(self.player, page=page, self_supervised=self_supervised)
+        epic = EpicGames.from_player(
+            self.player,
+            page=page,
+            modelhub=modelhub,
+            max_tabs=get_config().max_tabs,
+            journal=self._journal,
+            self_supervised=self_supervised,
+        )
 
         if not self.ctx_cookies_is_available:
             logger.info("Try to flush cookie", task="claim_epic_games")
-            if await epic.authorize(page):
+            with metrics.span("authorize"):
+                authorized = await epic.authorize(page)
+            if authorized:
                 cookies = await epic.flush_token(context)
                 self.player.cookies = cookies
+                if self._journal:
+                    await self._journal.arecord("authorized")
             else:
                 logger.error("Exit task", reason="Failed to flush token")
-                return
+                return False
 
-        if not self.promotions:
-            self.create_tasks()
+        if not self.promotions and not await self.create_tasks():
+            logger.error("Exit task", reason="Failed to get promotions")
+            return False
         if not self.promotions:
             logger.success(
                 "Pass claim task", reason="All free games are in my library", stage="claim-games"
             )
-            return
+            return True
 
         single_promotions = []
         bundle_promotions = []
@@ -119,15 +257,27 @@ class ISurrender:
                 single_promotions.append(p)
 
         if single_promotions:
-            await epic.claim_weekly_games(page, single_promotions)
+            with metrics.span("claim-weekly", promotions=len(single_promotions)):
+                await epic.claim_weekly_games(page, single_promotions)
         if bundle_promotions:
-            await epic.claim_bundle_games(page, bundle_promotions)
+            with metrics.span("claim-bundles", promotions=len(bundle_promotions)):
+                await epic.claim_bundle_games(page, bundle_promotions)
+
+        return True
 
     @logger.catch
-    async def stash(self):
+    async def stash(self) -> bool | None:
         if "linux" in sys.platform and "DISPLAY" not in os.environ:
             self.headless = True
 
+        with metrics.span("preflight"):
+            decision = await self.preflight()
+        if decision is not None:
+            return decision
+
+        import importlib_metadata
+        from playwright.async_api import async_playwright
+
         logger.info(
             "claim",
             image="20231121",
@@ -136,29 +286,289 @@ class ISurrender:
             headless=self.headless,
         )
 
-        async with async_playwright() as p:
-            context = await p.firefox.launch_persistent_context(
-                user_data_dir=self.player.browser_context_dir,
-                record_video_dir=self.player.record_dir,
-                record_har_path=self.player.record_har_path,
-                headless=self.headless,
-                locale=self.locale,
-                args=["--hide-crash-restore-bubble"],
+        with self.recording():
+            if self.browser:
+                with metrics.span("launch", mode="pool"):
+                    context = await self.new_context(self.browser)
+                return await self.stash_with_context(context)
+
+            async with async_playwright() as p:
+                with metrics.span("launch", mode="persistent"):
+                    context = await p.firefox.launch_persistent_context(
+                        user_data_dir=self.player.browser_context_dir,
+                        **self.record_options(),
+                        headless=self.headless,
+                        locale=self.locale,
+                        args=["--hide-crash-restore-bubble"],
+                    )
+                return await self.stash_with_context(context)
+
+    @logger.catch
+    async def refresh(self) -> bool | None:
+        """Sign in again and save the new session, nothing is claimed"""
+        if "linux" in sys.platform and "DISPLAY" not in os.environ:
+            self.headless = True
+
+        from playwright.async_api import async_playwright
+
+        with self.recording():
+            if self.browser:
+                context = await self.new_context(self.browser)
+                return await self.refresh_with_context(context)
+
+            async with async_playwright() as p:
+                context = await p.firefox.launch_persistent_context(
+                    user_data_dir=self.player.browser_context_dir,
+                    **self.record_options(),
+                    headless=self.headless,
+                    locale=self.locale,
+                    args=["--hide-crash-restore-bubble"],
+                )
+                return await self.refresh_with_context(context)
+
+    async def refresh_with_context(self, context: BrowserContext) -> bool | None:
+        from hcaptcha_challenger.agents import Malenia
+        from epic_games import EpicGames
+
+        result = None
+        try:
+            await Malenia.apply_stealth(context)
+            page = context.pages[0]
+            modelhub = await get_model_cache().aensure()
+            epic = EpicGames.from_player(
+                self.player, page=page, modelhub=modelhub, self_supervised=self_supervised
             )
+
+            # A session that still signs in may be extended by a visit alone,
+            # otherwise drop it so the login starts from a signed-out page
+            if expiry := session_expiry(self.player.storage_state):
+                await epic.flush_token(context)
+                result = session_expiry(self.player.storage_state) > expiry
+                if not result:
+                    await context.clear_cookies()
+
+            if not result:
+                with metrics.span("authorize"):
+                    if await epic.authorize(page):
+                        self.player.cookies = await epic.flush_token(context)
+                        result = True
+        finally:
+            await context.close()
+            self.finish_recording(success=bool(result))
+
+        return result
+
+    def record_options(self) -> Dict[str, Path]:
+        """Where the context writes its HAR and videos, according to `record_mode`"""
+        match get_config().record_mode:
+            case "off":
+                return {}
+            case "on-failure":
+                self._record_scratch = Path(tempfile.mkdtemp(dir=self.player.user_data_dir))
+                record_dir = self._record_scratch
+            case _:
+                record_dir = self.player.record_dir
+        return {
+            "record_video_dir": record_dir,
+            "record_har_path": record_dir.joinpath(self.player.record_har_path.name),
+        }
+
+    @contextmanager
+    def recording(self):
+        """
+        Scope of the launch and the claim, a scratch dir of `record_options` is never
+        left behind, not even when the browser or the context failed to come up
+        """
+        try:
+            yield
+        finally:
+            if scratch := self._record_scratch:
+                shutil.rmtree(scratch, ignore_errors=True)
+                self._record_scratch = None
+
+    def finish_recording(self, success: bool):
+        """Keep scratch recordings only for a failed claim, then apply the retention"""
+        if scratch := self._record_scratch:
+            if not success:
+                for fp in scratch.iterdir():
+                    shutil.move(fp, self.player.record_dir.joinpath(fp.name))
+                logger.info("Keep recordings", reason="claim failed", path=self.player.record_dir)
+            shutil.rmtree(scratch, ignore_errors=True)
+            self._record_scratch = None
+
+        config = get_config()
+        if removed := self.player.prune_records(
+            keep=config.record_keep, max_bytes=config.record_max_mb * 1024 * 1024
+        ):
+            logger.debug("Prune recordings", removed=removed, path=self.player.record_dir)
+
+    async def new_context(self, browser: Browser) -> BrowserContext:
+        """Isolated context on a shared browser, state is carried by the state store"""
+        context = await browser.new_context(
+            storage_state=self.player.storage_state,
+            **self.record_options(),
+            locale=self.locale,
+        )
+        try:
+            await context.new_page()
+        except BaseException:
+            await context.close()
+            raise
+        return context
+
+    async def stash_with_context(self, context: BrowserContext) -> bool | None:
+        from hcaptcha_challenger.agents import Malenia
+
+        route_stats = None
+        result = None
+        try:
             await Malenia.apply_stealth(context)
+            # The handler registered last runs first, blocked requests never reach the cache
+            if asset_cache := get_asset_cache():
+                await apply_asset_cache(context, asset_cache)
+            if profile := BlockProfile.from_name(get_config().block_profile):
+                route_stats = await apply_block_profile(context, profile)
 
-            if not await self.prelude_with_context(context):
-                install(upgrade=True, clip=True)
-                await self.claim_epic_games(context)
+            # The preflight already knows whether the cookie is valid or expired,
+            # the prelude page is only loaded when it could not tell
+            if not self.ctx_cookies_is_available and self.session != "expired":
+                with metrics.span("prelude"):
+                    result = await self.prelude_with_context(context)
+            if not result:
+                modelhub = await get_model_cache().aensure()
+                result = await self.claim_epic_games(context, modelhub=modelhub)
 
+            if self.browser:
+                await self.player.asave_state(await context.storage_state())
+        finally:
+            # HAR and videos are only complete once the context is closed
             await context.close()
+            self.finish_recording(success=bool(result))
+            if route_stats:
+                route_stats.report()
+            if asset_cache := get_asset_cache():
+                await asset_cache.aflush()
+                asset_cache.report()
+
+        return result
+
+
+async def claim_player(
+    player: EpicPlayer,
+    *,
+    headless: bool = True,
+    browser: Browser | None = None,
+    session: SessionStatus | None = None,
+) -> ClaimResult:
+    """Stash for one player, the outcome is kept in the state store"""
+    start = time.perf_counter()
+    agent = ISurrender(player=player, headless=headless, browser=browser, session=session)
+    with metrics.span("stash"):
+        success = bool(await agent.stash())
+    result = ClaimResult(
+        account=player.namespace, success=success, elapsed=round(time.perf_counter() - start, 2)
+    )
+    store = get_store()
+    await store.awrite(
+        store.record_claim,
+        result.account,
+        [p.namespace for p in agent.promotions],
+        success,
+        result.elapsed,
+    )
+    logger.info("stash", account=result.account, success=success, elapsed=result.elapsed)
+    return result
+
+
+async def refresh_player(player: EpicPlayer, *, browser: Browser | None = None) -> bool:
+    """Sign the player in again outside a claim, the login of SessionRefresher"""
+    with metrics.span("refresh"):
+        return bool(await ISurrender(player=player, browser=browser).refresh())
+
+
+async def stash_many(
+    players: List[EpicPlayer],
+    *,
+    concurrency: int = 1,
+    headless: bool = True,
+    browser: Browser | None = None,
+    sessions: Dict[str, SessionStatus] | None = None,
+) -> List[ClaimResult]:
+    """
+    Claim for every player, running at most `concurrency` accounts at the same time
+
+    Args:
+        players:
+        concurrency:
+        headless:
+        browser: Share one browser process between all players
+        sessions: Result of validate_sessions, saves every player its own check
+
+    Returns:
+
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _stash(player: EpicPlayer) -> ClaimResult:
+        async with semaphore:
+            with logger.contextualize(account=player.namespace):
+                return await claim_player(
+                    player,
+                    headless=headless,
+                    browser=browser,
+                    session=(sessions or {}).get(player.namespace),
+                )
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[_stash(player) for player in players])
+
+    logger.success(
+        "stash_many",
+        accounts=len(results),
+        success=sum(r.success for r in results),
+        failed=[r.account for r in results if not r.success],
+        concurrency=concurrency,
+        elapsed=round(time.perf_counter() - start, 2),
+    )
+    return results
+
+
+async def claim_all(players: List[EpicPlayer] | None = None) -> List[ClaimResult]:
+    """One pass over every account of the config, shared by `run` and the daemon"""
+    config = get_config()
+    players = players or EpicPlayer.from_accounts()
+    if not players:
+        logger.error("Exit task", reason="No Epic account in the config")
+        return []
+
+    if len(players) == 1:
+        return [await claim_player(players[0], headless=False)]
+
+    # One concurrent round of session checks, only the expired accounts will log in
+    sessions = await validate_sessions(players)
+    if not config.browser_pool:
+        return await stash_many(players, concurrency=config.concurrency, sessions=sessions)
+
+    from playwright.async_api import async_playwright
+
+    async with async_playwright() as p:
+        browser = await p.firefox.launch(args=["--hide-crash-restore-bubble"])
+        results = await stash_many(
+            players, concurrency=config.concurrency, browser=browser, sessions=sessions
+        )
+        await browser.close()
+    return results
 
 
 async def run():
-    agent = ISurrender.from_epic()
-    agent.headless = False
-    await agent.stash()
+    try:
+        await claim_all()
+    finally:
+        await aclose_client()
+        metrics.report()
+        limiter.report()
 
 
 if __name__ == "__main__":
+    init_logger()
     asyncio.run(run())
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/12/2 16:40
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description: Long-running claim scheduler driven by the promotion windows
+"""
+python3 daemon.py
+python3 daemon.py --grace 300 --max-sleep 43200
+
+Instead of a daily cron, claim for every account as soon as a promotion window
+opens, then sleep until the next one:
+
+- The wake-up time is the nearest endDate of the current offers or startDate of
+  the upcoming offers in freeGamesPromotions, plus a grace period for the feed
+- The feed is re-read every --recheck seconds while it still lags behind a window
+  that should already be open, and at least every --max-sleep seconds otherwise
+- The promotions cache, the shared HTTP client and the captcha models stay in memory
+  between windows, the models are upgrade-checked while the daemon is idle
+- Sessions that expire within --refresh-within seconds are signed in again while
+  idle, at most --refresh-max logins per sleep, so a window rarely waits for a login
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+from typing import FrozenSet
+
+from loguru import logger
+
+from claim import claim_all, get_model_cache, refresh_player
+from epic_games import EpicPlayer, aget_promotions
+from epic_games.api import promotions_cache
+from epic_games.session import SessionRefresher
+from settings import init_logger
+from utils import aclose_client, limiter
+from utils.metrics import metrics
+
+
+def _fmt_ts(ts: float) -> str:
+    return datetime.fromtimestamp(ts).isoformat(timespec="seconds")
+
+
+async def claim_window(claimed: FrozenSet[str]) -> FrozenSet[str] | None:
+    """
+    Claim for every account if the feed shows games not claimed yet
+
+    Returns: Namespaces of the window once every account is done, None to retry it
+
+    """
+    games = await aget_promotions()
+    if games is None:
+        return
+    window = frozenset(g.namespace for g in games)
+    if not window or window == claimed:
+        return claimed
+
+    logger.info("Promotion window", games=[g.title for g in games])
+    try:
+        results = await claim_all()
+    except Exception as err:
+        logger.exception("Promotion window failed", err=err)
+        return
+    finally:
+        metrics.report()
+        metrics.reset()
+        # Counters and breaker states carry over, the limits are per process
+        limiter.report()
+
+    if failed := [r.account for r in results if not r.success]:
+        logger.warning("Promotion window not done", failed=failed)
+        return
+    return window
+
+
+async def warm_up():
+    """Idle work between windows, so the next claim finds the models ready"""
+    try:
+        await get_model_cache().aensure()
+    except Exception as err:
+        logger.warning("Failed to warm up the models", err=err)
+
+
+async def serve(grace: int, recheck: int, retry: int, max_sleep: int, refresher: SessionRefresher):
+    claimed: FrozenSet[str] = frozenset()
+
+    while True:
+        done = await claim_window(claimed)
+        if done is not None:
+            claimed = done
+        await warm_up()
+
+        now = time.time()
+        if done is None:
+            delay = retry
+        elif (wake := promotions_cache.next_window(now)) is not None:
+            delay = min(wake - now + grace, max_sleep)
+        else:
+            # Every boundary of the feed is in the past, the next window is late
+            delay = recheck
+
+        # Sign in again now rather than in the middle of the next window
+        wake = now + max(delay, 1)
+        await refresher.refresh(EpicPlayer.from_accounts(), refresh_player, deadline=wake)
+
+        logger.info("Sleep until the next promotion window", wake=_fmt_ts(wake))
+        await asyncio.sleep(max(wake - time.time(), 1))
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--grace", type=int, default=120, help="seconds after a window opens")
+    parser.add_argument("--recheck", type=int, default=600, help="seconds while the feed lags")
+    parser.add_argument("--retry", type=int, default=1800, help="seconds after a failed claim")
+    parser.add_argument("--max-sleep", type=int, default=6 * 3600)
+    parser.add_argument(
+        "--refresh-within", type=int, default=2 * 86400, help="seconds before a session expires"
+    )
+    parser.add_argument("--refresh-max", type=int, default=2, help="logins while idle, 0 for none")
+    args = parser.parse_args()
+
+    refresher = SessionRefresher(horizon=args.refresh_within, max_logins=args.refresh_max)
+    try:
+        await serve(args.grace, args.recheck, args.retry, args.max_sleep, refresher)
+    finally:
+        await aclose_client()
+
+
+if __name__ == "__main__":
+    init_logger()
+    asyncio.run(main())
@@ -3,9 +3,19 @@
 # Author     : QIN2DIM
 # Github     : https://github.com/QIN2DIM
 # Description:
-from .agent import EpicGames, Game, CompletedOrder, get_promotions, get_order_history
-
+from .api import (
+    Game,
+    CompletedOrder,
+    get_promotions,
+    get_order_history,
+    aget_promotions,
+    aget_order_history,
+    sync_order_history,
+)
+from .library import Library
 from .player import EpicPlayer
+from .session import validate_sessions
+from .store import StateStore, get_store
 
 __all__ = [
     "EpicGames",
@@ -13,5 +23,21 @@ __all__ = [
     "CompletedOrder",
     "get_order_history",
     "get_promotions",
+    "aget_order_history",
+    "aget_promotions",
+    "sync_order_history",
     "EpicPlayer",
+    "Library",
+    "StateStore",
+    "get_store",
+    "validate_sessions",
 ]
+
+
+def __getattr__(name: str):
+    # EpicGames drags in Playwright and the solver, load it only on the browser path
+    if name == "EpicGames":
+        from .agent import EpicGames
+
+        return EpicGames
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -5,55 +5,62 @@
 # Description:
 from __future__ import annotations
 
-import json
+import asyncio
+import time
 from contextlib import suppress
 from dataclasses import dataclass, field
-from json import JSONDecodeError
 from pathlib import Path
-from typing import List, Dict, Literal
+from typing import List, Dict, Literal, Any
 
-import httpx
 from loguru import logger
 from playwright.async_api import BrowserContext, expect, TimeoutError, Page, FrameLocator, Locator
 from tenacity import *
 
+from epic_games.api import (
+    URL_CLAIM,
+    URL_LOGIN,
+    URL_CART,
+    URL_CART_SUCCESS,
+    Game,
+    get_promotions,
+)
+from epic_games.journal import ClaimJournal, Step
 from epic_games.player import EpicPlayer
-from utils import from_dict_to_model, AgentG
-
-# fmt:off
-URL_CLAIM = "https://store.epicgames.com/en-US/free-games"
-URL_LOGIN = f"https://www.epicgames.com/id/login?lang=en-US&noHostRedirect=true&redirectUrl={URL_CLAIM}"
-URL_PROMOTIONS = "https://store-site-backend-static.ak.epicgames.com/freeGamesPromotions"
-URL_PRODUCT_PAGE = "https://store.epicgames.com/en-US/p/"
-URL_PRODUCT_BUNDLES = "https://store.epicgames.com/en-US/bundles/"
-URL_ORDER_HISTORY = "https://www.epicgames.com/account/v2/payment/ajaxGetOrderHistory"
-URL_CART = "https://store.epicgames.com/en-US/cart"
-URL_CART_SUCCESS = "https://store.epicgames.com/en-US/cart/success"
-# -----
-URL_STORE_EXPLORER = "https://store.epicgames.com/en-US/browse?sortBy=releaseDate&sortDir=DESC&priceTier=tierFree&count=40"
-URL_STORE_EXPLORER_GRAPHQL = (
-    "https://store.epicgames.com/graphql?operationName=searchStoreQuery"
-    '&variables={"category":"games/edition/base","comingSoon":false,"count":80,"freeGame":true,"keywords":"","sortBy":"releaseDate","sortDir":"DESC","start":0,"tag":"","withPrice":true}'
-    '&extensions={"persistedQuery":{"version":1,"sha256Hash":"13a2b6787f1a20d05c75c54c78b1b8ac7c8bf4efc394edf7a5998fdf35d1adb0"}}'
+from utils import AgentG, limiter
+from utils.limits import watch_responses
+from utils.metrics import metrics
+
+# Cards of the cart that are not free, the same rule as //span[text()='Free']
+_JS_PAID_CARDS = """
+() => [...document.querySelectorAll("div[data-testid='offer-card-layout-wrapper']")].filter(
+    (card) => ![...card.querySelectorAll("span")].some((s) => s.textContent.trim() === "Free")
 )
+"""
 
-# fmt:on
+_JS_MOVE_PAID_TO_WISHLIST = f"""
+() => {{
+    let clicked = 0;
+    for (const card of ({_JS_PAID_CARDS})()) {{
+        const label = [...card.querySelectorAll("button span")].find(
+            (s) => s.textContent.trim() === "Move to wishlist"
+        );
+        if (label) {{
+            label.closest("button").click();
+            clicked += 1;
+        }}
+    }}
+    return clicked;
+}}
+"""
 
+_JS_NO_PAID_CARDS = f"() => ({_JS_PAID_CARDS})().length === 0"
 
-@dataclass
-class CompletedOrder:
-    offerId: str
-    namespace: str
+# The webPurchaseContainer iframe, its responses feed the checkout breaker
+CHECKOUT_HOSTS = ("payment-website-pci.ol.epicgames.com",)
 
 
-@dataclass
-class Game:
-    url: str
-    namespace: str
-    title: str
-    thumbnail: str
-    id: str
-    in_library = None
+def _waited(step: str, start: float):
+    metrics.record(f"wait:{step}", time.perf_counter() - start)
 
 
 class CommonHandler:
@@ -69,9 +76,14 @@ class CommonHandler:
     async def move_to_purchase_container(page: Page):
         wpc = page.frame_locator("//iframe[@class='']")
         payment_btn = wpc.locator("//div[@class='payment-order-confirm']")
+        start = time.perf_counter()
         with suppress(Exception):
             await expect(payment_btn).to_be_attached()
-        await page.wait_for_timeout(2000)
+        # The order summary is rendered before the place-order button is wired up,
+        # only the <button> itself can be disabled, the wrapping div never is
+        with suppress(AssertionError):
+            await expect(payment_btn.locator("button").first).to_be_enabled(timeout=10000)
+        _waited("payment-button", start)
         await payment_btn.click(timeout=6000)
 
         return wpc, payment_btn
@@ -90,7 +102,7 @@ class CommonHandler:
     @staticmethod
     @retry(
         retry=retry_if_exception_type(TimeoutError),
-        wait=wait_fixed(0.5),
+        wait=wait_fixed(0.5) + wait_random(0, 1),
         stop=stop_after_attempt(15),
         reraise=True,
     )
@@ -102,13 +114,20 @@ class CommonHandler:
         recur_url: str,
         is_uk: bool,
     ):
-        response = await solver.execute(window="free")
+        # Paced across accounts only, a challenge that times out is not an outage
+        async with limiter.guard("challenge"):
+            with metrics.span("insert-challenge"):
+                response = await solver.execute(window="free")
         logger.debug("task done", sattus=f"{solver.status.CHALLENGE_SUCCESS}")
 
         match response:
             case solver.status.CHALLENGE_BACKCALL | solver.status.CHALLENGE_RETRY:
                 await wpc.locator("//a[@class='talon_close_button']").click()
-                await page.wait_for_timeout(1000)
+                start = time.perf_counter()
+                with suppress(TimeoutError):
+                    challenge = wpc.locator(AgentG.HOOK_CHALLENGE).first
+                    await challenge.wait_for(state="hidden", timeout=5000)
+                _waited("challenge-closed", start)
                 if is_uk:
                     await CommonHandler.uk_confirm_order(wpc)
                 await payment_btn.click(delay=200)
@@ -123,40 +142,37 @@ class CommonHandler:
         URL_WISHLIST = "https://store.epicgames.com/en-US/wishlist"
         //span[text()='Your Cart is empty.']
 
+        Every pass finds the paid cards and clicks their "Move to wishlist" in a single
+        in-page evaluation, then waits once for the cart to re-render without them.
+
         Args:
-            wait_rerender:
+            wait_rerender: Maximum number of passes
             page:
 
         Returns:
 
         """
-        has_paid_free = False
+        start = time.perf_counter()
+        moved = 0
 
         try:
-            # Check all items in the shopping cart
-            cards = await page.query_selector_all("//div[@data-testid='offer-card-layout-wrapper']")
-
-            # Move paid games to wishlist games
-            for card in cards:
-                is_free = await card.query_selector("//span[text()='Free']")
-                if not is_free:
-                    has_paid_free = True
-                    wishlist_btn = await card.query_selector(
-                        "//button//span[text()='Move to wishlist']"
-                    )
-                    await wishlist_btn.click()
-
-            # Wait up to 60 seconds for the page to re-render.
-            # Usually it takes 1~3s for the web page to be re-rendered
-            # - Set threshold for overflow in case of poor Epic network
-            # - It can also prevent extreme situations, such as: the user’s shopping cart has nearly a hundred products
-            if has_paid_free and wait_rerender:
-                wait_rerender -= 1
-                await page.wait_for_timeout(2000)
-                return await CommonHandler.empty_cart(page, wait_rerender)
+            for _ in range(wait_rerender):
+                clicked = await page.evaluate(_JS_MOVE_PAID_TO_WISHLIST)
+                if not clicked:
+                    break
+                moved += clicked
+                # Usually it takes 1~3s for the web page to be re-rendered,
+                # a pass that times out is simply followed by another one
+                with suppress(TimeoutError):
+                    await page.wait_for_function(_JS_NO_PAID_CARDS, timeout=10000)
+            logger.info(
+                "empty_cart",
+                moved=moved,
+                elapsed=f"{(time.perf_counter() - start) * 1000:.0f}ms",
+            )
             return True
         except TimeoutError as err:
-            logger.warning("Failed to empty shopping cart", err=err)
+            logger.warning("Failed to empty shopping cart", err=err, moved=moved)
             return False
 
 
@@ -178,19 +194,53 @@ class EpicGames:
     considered metadata for task sequence of the agent
     """
 
+    max_tabs: int = 1
+    """
+    Product pages prepared at the same time in claim_weekly_games,
+    and bundles purchased at the same time in claim_bundle_games,
+    each in its own tab of the same context
+    """
+
+    _solver_opt: Dict[str, Any] = field(default_factory=dict)
+    """
+    Options used to create the solver, reused for the solvers of extra tabs
+    """
+
+    journal: ClaimJournal | None = None
+    """
+    Progress of the promotions is appended as soon as each step completes
+    """
+
     @classmethod
     def from_player(
-        cls, player: EpicPlayer, *, page: Page, tmp_dir: Path | None = None, **solver_opt
+        cls,
+        player: EpicPlayer,
+        *,
+        page: Page,
+        tmp_dir: Path | None = None,
+        modelhub=None,
+        max_tabs: int = 1,
+        journal: ClaimJournal | None = None,
+        **solver_opt,
     ):
         """尽可能早地实例化，用于部署 captcha 事件监听器"""
+        solver = AgentG.from_page(page=page, tmp_dir=tmp_dir, modelhub=modelhub, **solver_opt)
         return cls(
-            player=player, _solver=AgentG.from_page(page=page, tmp_dir=tmp_dir, **solver_opt)
+            player=player,
+            _solver=solver,
+            max_tabs=max_tabs,
+            _solver_opt={"tmp_dir": tmp_dir, **solver_opt},
+            journal=journal,
         )
 
     @property
     def handle(self):
         return CommonHandler
 
+    async def _record(self, step: Step, promotions: List[Game]):
+        if self.journal and promotions:
+            await self.journal.arecord(step, promotions)
+
     @property
     def promotions(self) -> List[Game]:
         self._promotions = self._promotions or get_promotions()
@@ -214,7 +264,8 @@ class EpicGames:
                             break
                         logger.debug("Attack challenge", stage=stage)
                 fall_in_challenge = True
-                result = await self._solver.execute(window=stage)
+                with metrics.span("login-challenge", window=stage):
+                    result = await self._solver.execute(window=stage)
                 logger.debug("Parse result", stage=stage, result=result)
                 match result:
                     case self._solver.status.CHALLENGE_BACKCALL:
@@ -275,216 +326,211 @@ class EpicGames:
             "https://store.epicgames.com/zh-CN/p/orwell-keeping-an-eye-on-you",
             wait_until="networkidle",
         )
-        await context.storage_state(path=self.player.ctx_cookie_path)
-        cookies = self.player.ctx_cookies.reload(self.player.ctx_cookie_path)
-        logger.success("flush_token", path=self.player.ctx_cookie_path)
+        cookies = await self.player.asave_state(await context.storage_state())
+        logger.success("flush_token", account=self.player.namespace)
         return cookies
 
+    async def add_to_cart(self, page: Page, promotion: Game) -> bool | None:
+        logger.info("claim_weekly_games", action="go to store", url=promotion.url)
+        await page.goto(promotion.url, wait_until="load")
+
+        # <-- Handle pre-page
+        with suppress(TimeoutError):
+            await page.click("//button//span[text()='Continue']", timeout=3000)
+
+        # --> Make sure promotion is not in the library before executing
+        cta_btn = page.locator("//aside//button[@data-testid='add-to-cart-cta-button']")
+        with suppress(TimeoutError):
+            text = await cta_btn.text_content(timeout=10000)
+            if text == "View In Cart":
+                return True
+            if text == "Add To Cart":
+                await cta_btn.click()
+                await expect(cta_btn).to_have_text("View In Cart")
+                return True
+
+    async def add_to_cart_in_tabs(self, page: Page, promotions: List[Game]) -> List[Game]:
+        """Prepare every promotion in its own tab, at most `max_tabs` open at once"""
+        semaphore = asyncio.Semaphore(self.max_tabs)
+
+        async def _prepare(promotion: Game) -> bool | None:
+            async with semaphore:
+                tab = await page.context.new_page()
+                try:
+                    return await self.add_to_cart(tab, promotion)
+                finally:
+                    await tab.close()
+
+        start = time.perf_counter()
+        # Every tab is closed before an error reaches the retry, which opens a new set
+        results = await asyncio.gather(*[_prepare(p) for p in promotions], return_exceptions=True)
+        _waited("add-to-cart-in-tabs", start)
+
+        errors = [r for r in results if isinstance(r, BaseException)]
+        for promotion, result in zip(promotions, results):
+            if isinstance(result, BaseException):
+                logger.error("add_to_cart_in_tabs", url=promotion.url, err=result)
+        if errors:
+            raise errors[0]
+
+        return [p for p, r in zip(promotions, results) if r]
+
     @retry(
         retry=retry_if_exception_type(TimeoutError),
-        wait=wait_fixed(0.5),
+        wait=wait_fixed(0.5) + wait_random(0, 1),
         stop=(stop_after_delay(360) | stop_after_attempt(3)),
         reraise=True,
     )
     async def claim_weekly_games(self, page: Page, promotions: List[Game]):
-        in_cart_nums = 0
+        in_cart: List[Game] = []
 
         # --> Add promotions to Cart
-        for promotion in promotions:
-            logger.info("claim_weekly_games", action="go to store", url=promotion.url)
-            await page.goto(promotion.url, wait_until="load")
-
-            # <-- Handle pre-page
-            with suppress(TimeoutError):
-                await page.click("//button//span[text()='Continue']", timeout=3000)
-
-            # --> Make sure promotion is not in the library before executing
-            cta_btn = page.locator("//aside//button[@data-testid='add-to-cart-cta-button']")
-            with suppress(TimeoutError):
-                text = await cta_btn.text_content(timeout=10000)
-                if text == "View In Cart":
-                    in_cart_nums += 1
-                    continue
-                if text == "Add To Cart":
-                    await cta_btn.click()
-                    await expect(cta_btn).to_have_text("View In Cart")
-                    in_cart_nums += 1
-
-        if in_cart_nums == 0:
+        with metrics.span("add-to-cart", promotions=len(promotions), tabs=self.max_tabs):
+            if self.max_tabs > 1 and len(promotions) > 1:
+                in_cart = await self.add_to_cart_in_tabs(page, promotions)
+            else:
+                for promotion in promotions:
+                    if await self.add_to_cart(page, promotion):
+                        in_cart.append(promotion)
+        await self._record("in_cart", in_cart)
+
+        if not in_cart:
             logger.success("Pass claim task", reason="Free games not added to shopping cart")
             return
 
-        # --> Goto cart page
-        await page.goto(URL_CART, wait_until="domcontentloaded")
-        await self.handle.empty_cart(page)
-        await page.click("//button//span[text()='Check Out']")
+        checkout = limiter.endpoint("checkout")
+        with metrics.span("checkout"), watch_responses(page, checkout, CHECKOUT_HOSTS):
+            # Paced across accounts, rejected at once while the purchase endpoint is down
+            async with limiter.guard("checkout"):
+                # --> Goto cart page
+                await page.goto(URL_CART, wait_until="domcontentloaded")
+                await self.handle.empty_cart(page)
+                await page.click("//button//span[text()='Check Out']")
 
-        # <-- Handle Any LICENSE
-        await self.handle.any_license(page)
+                # <-- Handle Any LICENSE
+                await self.handle.any_license(page)
 
-        # --> Move to webPurchaseContainer iframe
-        logger.info("claim_weekly_games", action="move to webPurchaseContainer iframe")
-        wpc, payment_btn = await self.handle.move_to_purchase_container(page)
-        logger.info("claim_weekly_games", action="click payment button")
+                # --> Move to webPurchaseContainer iframe
+                logger.info("claim_weekly_games", action="move to webPurchaseContainer iframe")
+                wpc, payment_btn = await self.handle.move_to_purchase_container(page)
+                logger.info("claim_weekly_games", action="click payment button")
+                await self._record("checked_out", in_cart)
 
-        # <-- Handle UK confirm-order
-        is_uk = await self.handle.uk_confirm_order(wpc)
+                # <-- Handle UK confirm-order
+                is_uk = await self.handle.uk_confirm_order(wpc)
 
-        # <-- Insert challenge
-        recur_url = URL_CART_SUCCESS
-        await self.handle.insert_challenge(self._solver, page, wpc, payment_btn, recur_url, is_uk)
+            # <-- Insert challenge
+            recur_url = URL_CART_SUCCESS
+            await self.handle.insert_challenge(
+                self._solver, page, wpc, payment_btn, recur_url, is_uk
+            )
 
-        # --> Wait for success
-        await page.wait_for_url(recur_url)
-        logger.success("claim_weekly_games", action="success", url=page.url)
+            # --> Wait for success
+            await page.wait_for_url(recur_url)
+            await self._record("confirmed", in_cart)
+            logger.success("claim_weekly_games", action="success", url=page.url)
 
         return True
 
     @retry(
         retry=retry_if_exception_type(TimeoutError),
-        wait=wait_fixed(0.5),
+        wait=wait_fixed(0.5) + wait_random(0, 1),
         stop=(stop_after_delay(360) | stop_after_attempt(3)),
         reraise=True,
     )
-    async def claim_bundle_games(self, page: Page, promotions: List[Game]):
-        for promotion in promotions:
-            logger.info("claim_bundle_games", action="go to store", url=promotion.url)
-            await page.goto(promotion.url, wait_until="load")
-
-            # <-- Handle pre-page
-            with suppress(TimeoutError):
-                await page.click("//button//span[text()='Continue']", timeout=3000)
-
-            # --> Make sure promotion is not in the library before executing
-            purchase_btn = page.locator("//button[@data-testid='purchase-cta-button']").first
-            with suppress(TimeoutError):
-                text = await purchase_btn.text_content(timeout=10000)
-                if text == "Get":
-                    await purchase_btn.click()
-                    await page.wait_for_timeout(2000)
-                else:
-                    continue
-
-            # <-- Handle Any LICENSE
-            await self.handle.any_license(page)
-
-            # --> Move to webPurchaseContainer iframe
-            logger.info("claim_bundle_games", action="move to webPurchaseContainer iframe")
-            wpc, payment_btn = await self.handle.move_to_purchase_container(page)
-            logger.info("claim_bundle_games", action="click payment button")
-
-            # <-- Handle UK confirm-order
-            is_uk = await self.handle.uk_confirm_order(wpc)
+    async def claim_bundle(self, page: Page, promotion: Game, solver: AgentG) -> bool | None:
+        """Purchase one bundle on `page`, the challenge is solved by the solver bound to it"""
+        logger.info("claim_bundle_games", action="go to store", url=promotion.url)
+        await page.goto(promotion.url, wait_until="load")
 
-            # <-- Insert challenge
-            recur_url = f"https://store.epicgames.com/en-US/download?ns={promotion.namespace}&id={promotion.id}"
-            await self.handle.insert_challenge(
-                self._solver, page, wpc, payment_btn, recur_url, is_uk
-            )
-
-            # --> Wait for success
-            await page.wait_for_url(recur_url)
-            logger.success("claim_bundle_games", action="success", url=page.url)
+        # <-- Handle pre-page
+        with suppress(TimeoutError):
+            await page.click("//button//span[text()='Continue']", timeout=3000)
 
-            return True
+        # --> Make sure promotion is not in the library before executing
+        purchase_btn = page.locator("//button[@data-testid='purchase-cta-button']").first
+        with suppress(TimeoutError):
+            text = await purchase_btn.text_content(timeout=10000)
+            if text == "Get":
+                await purchase_btn.click()
+                # Either the license dialog or the purchase iframe comes up next
+                start = time.perf_counter()
+                await page.locator(
+                    "//label[@for='agree'] | //div[@id='webPurchaseContainer']//iframe"
+                ).first.wait_for(state="attached", timeout=10000)
+                _waited("purchase-container", start)
+            else:
+                return
 
+        checkout = limiter.endpoint("checkout")
+        with watch_responses(page, checkout, CHECKOUT_HOSTS):
+            async with limiter.guard("checkout"):
+                # <-- Handle Any LICENSE
+                await self.handle.any_license(page)
 
-@retry(
-    retry=retry_if_exception_type(httpx.RequestError),
-    wait=wait_random_exponential(),
-    stop=(stop_after_delay(30) | stop_after_attempt(3)),
-    reraise=True,
-)
-def get_promotions() -> List[Game]:
-    """
-    获取周免游戏数据
+                # --> Move to webPurchaseContainer iframe
+                logger.info("claim_bundle_games", action="move to webPurchaseContainer iframe")
+                wpc, payment_btn = await self.handle.move_to_purchase_container(page)
+                logger.info("claim_bundle_games", action="click payment button")
+                await self._record("checked_out", [promotion])
 
-    <即将推出> promotion["promotions"]["upcomingPromotionalOffers"]
-    <本周免费> promotion["promotions"]["promotionalOffers"]
-    :return: {"pageLink1": "pageTitle1", "pageLink2": "pageTitle2", ...}
-    """
+                # <-- Handle UK confirm-order
+                is_uk = await self.handle.uk_confirm_order(wpc)
 
-    def _has_discount_target(prot: dict) -> bool | None:
-        with suppress(KeyError, IndexError, TypeError):
-            offers = prot["promotions"]["promotionalOffers"][0]["promotionalOffers"]
-            for i, offer in enumerate(offers):
-                if offer["discountSetting"]["discountPercentage"] == 0:
-                    return True
-
-    _promotions: List[Game] = []
-
-    headers = {
-        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)"
-        " Chrome/115.0.0.0 Safari/537.36 Edg/115.0.1901.203"
-    }
-    params = {"local": "en-US"}
-
-    client = httpx.Client(params=params, headers=headers, http2=True)
-    resp = client.get(URL_PROMOTIONS)
-
-    try:
-        data = resp.json()
-    except JSONDecodeError as err:
-        logger.error("Failed to get promotions", err=err)
-    else:
-        elements = data["data"]["Catalog"]["searchStore"]["elements"]
-        promotions = [e for e in elements if e.get("promotions")]
-        # Get store promotion data and <this week free> games
-        for promotion in promotions:
-            # Remove items that are discounted but not free.
-            if not _has_discount_target(promotion):
-                continue
-            # package free games
-            try:
-                query = promotion["catalogNs"]["mappings"][0]["pageSlug"]
-                promotion["url"] = f"{URL_PRODUCT_PAGE}{query}"
-            except TypeError:
-                promotion["url"] = f"{URL_PRODUCT_BUNDLES}{promotion['productSlug']}"
-            except IndexError:
-                promotion["url"] = f"{URL_PRODUCT_PAGE}{promotion['productSlug']}"
+            # <-- Insert challenge
+            recur_url = (
+                "https://store.epicgames.com/en-US/download"
+                f"?ns={promotion.namespace}&id={promotion.id}"
+            )
+            await self.handle.insert_challenge(solver, page, wpc, payment_btn, recur_url, is_uk)
 
-            promotion["thumbnail"] = promotion["keyImages"][-1]["url"]
-            _promotions.append(from_dict_to_model(Game, promotion))
+            # --> Wait for success
+            await page.wait_for_url(recur_url)
+            await self._record("confirmed", [promotion])
+            logger.success("claim_bundle_games", action="success", url=page.url)
 
-    return _promotions
+        return True
 
+    async def claim_bundle_games(self, page: Page, promotions: List[Game]):
+        """
+        Claim every bundle in one run
 
-def get_order_history(
-    cookies: Dict[str, str], page: str | None = None, last_create_at: str | None = None
-) -> List[CompletedOrder]:
-    """获取最近的订单纪录"""
+        With `max_tabs` > 1 the bundles are purchased in parallel tabs, each tab gets its
+        own solver so the captcha responses and frames of one purchase never reach another.
+        """
+        if self.max_tabs <= 1 or len(promotions) < 2:
+            # One bundle failing must not cost the others, like in the parallel path
+            results = []
+            for promotion in promotions:
+                try:
+                    results.append(await self.claim_bundle(page, promotion, self._solver))
+                except Exception as err:
+                    results.append(err)
+        else:
+            results = await self.claim_bundles_in_tabs(page, promotions)
+
+        errors = [r for r in results if isinstance(r, BaseException)]
+        for promotion, result in zip(promotions, results):
+            if isinstance(result, BaseException):
+                logger.error("claim_bundle_games", url=promotion.url, err=result)
+        if errors:
+            raise errors[0]
+
+        return any(results)
+
+    async def claim_bundles_in_tabs(self, page: Page, promotions: List[Game]) -> List[Any]:
+        """Every bundle in its own tab and solver, results and exceptions in promotion order"""
+        semaphore = asyncio.Semaphore(self.max_tabs)
+
+        async def _claim(promotion: Game) -> bool | None:
+            async with semaphore:
+                tab = await page.context.new_page()
+                try:
+                    solver = AgentG.from_page(
+                        page=tab, modelhub=self._solver.modelhub, **self._solver_opt
+                    )
+                    return await self.claim_bundle(tab, promotion, solver)
+                finally:
+                    await tab.close()
 
-    @retry(
-        retry=retry_if_exception_type(httpx.RequestError),
-        wait=wait_random_exponential(),
-        stop=(stop_after_delay(30) | stop_after_attempt(3)),
-        reraise=True,
-    )
-    def request_history() -> str | None:
-        resp = client.get(URL_ORDER_HISTORY)
-        if not resp.is_success:
-            raise httpx.RequestError("Failed to get order history, cookie may have expired")
-        return resp.text
-
-    headers = {
-        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)"
-        " Chrome/115.0.0.0 Safari/537.36 Edg/115.0.1901.203"
-    }
-    params = {"locale": "zh-CN", "page": page or "0", "latCreateAt": last_create_at or ""}
-    client = httpx.Client(headers=headers, cookies=cookies, params=params, http2=True)
-
-    completed_orders: List[CompletedOrder] = []
-
-    try:
-        data = json.loads(request_history())
-        for order in data["orders"]:
-            if order["orderType"] != "PURCHASE":
-                continue
-            for item in order["items"]:
-                if len(item["namespace"]) != 32:
-                    continue
-                completed_orders.append(from_dict_to_model(CompletedOrder, item))
-    except (httpx.RequestError, JSONDecodeError, KeyError) as err:
-        logger.warning(err)
-
-    return completed_orders
+        return await asyncio.gather(*[_claim(p) for p in promotions], return_exceptions=True)
@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/11/25 16:02
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description: Plain HTTP side of the store, must not import Playwright or the solver
+from __future__ import annotations
+
+import asyncio
+import copy
+import json
+import time
+from contextlib import suppress
+from dataclasses import dataclass, field
+from datetime import datetime
+from json import JSONDecodeError
+from typing import List, Dict, Any
+
+import httpx
+from loguru import logger
+from tenacity import *
+
+from epic_games.library import Library
+from epic_games.player import EpicPlayer
+from epic_games.store import get_store
+from utils import from_dict_to_model, get_client, cookie_header, DEFAULT_HEADERS, CircuitOpen
+
+# fmt:off
+URL_CLAIM = "https://store.epicgames.com/en-US/free-games"
+URL_LOGIN = f"https://www.epicgames.com/id/login?lang=en-US&noHostRedirect=true&redirectUrl={URL_CLAIM}"
+URL_PROMOTIONS = "https://store-site-backend-static.ak.epicgames.com/freeGamesPromotions"
+URL_PRODUCT_PAGE = "https://store.epicgames.com/en-US/p/"
+URL_PRODUCT_BUNDLES = "https://store.epicgames.com/en-US/bundles/"
+URL_ORDER_HISTORY = "https://www.epicgames.com/account/v2/payment/ajaxGetOrderHistory"
+URL_CART = "https://store.epicgames.com/en-US/cart"
+URL_CART_SUCCESS = "https://store.epicgames.com/en-US/cart/success"
+# -----
+URL_STORE_EXPLORER = "https://store.epicgames.com/en-US/browse?sortBy=releaseDate&sortDir=DESC&priceTier=tierFree&count=40"
+URL_STORE_EXPLORER_GRAPHQL = (
+    "https://store.epicgames.com/graphql?operationName=searchStoreQuery"
+    '&variables={"category":"games/edition/base","comingSoon":false,"count":80,"freeGame":true,"keywords":"","sortBy":"releaseDate","sortDir":"DESC","start":0,"tag":"","withPrice":true}'
+    '&extensions={"persistedQuery":{"version":1,"sha256Hash":"13a2b6787f1a20d05c75c54c78b1b8ac7c8bf4efc394edf7a5998fdf35d1adb0"}}'
+)
+
+# fmt:on
+
+
+@dataclass
+class CompletedOrder:
+    offerId: str
+    namespace: str
+
+
+@dataclass
+class Game:
+    url: str
+    namespace: str
+    title: str
+    thumbnail: str
+    id: str
+    in_library = None
+
+
+def _has_discount_target(prot: dict) -> bool | None:
+    with suppress(KeyError, IndexError, TypeError):
+        offers = prot["promotions"]["promotionalOffers"][0]["promotionalOffers"]
+        for i, offer in enumerate(offers):
+            if offer["discountSetting"]["discountPercentage"] == 0:
+                return True
+
+
+def parse_promotions(data: dict) -> List[Game]:
+    """Pick <this week free> games out of the freeGamesPromotions payload"""
+    _promotions: List[Game] = []
+
+    elements = data["data"]["Catalog"]["searchStore"]["elements"]
+    promotions = [e for e in elements if e.get("promotions")]
+    # Get store promotion data and <this week free> games
+    for promotion in promotions:
+        # Remove items that are discounted but not free.
+        if not _has_discount_target(promotion):
+            continue
+        # package free games
+        try:
+            query = promotion["catalogNs"]["mappings"][0]["pageSlug"]
+            promotion["url"] = f"{URL_PRODUCT_PAGE}{query}"
+        except TypeError:
+            promotion["url"] = f"{URL_PRODUCT_BUNDLES}{promotion['productSlug']}"
+        except IndexError:
+            promotion["url"] = f"{URL_PRODUCT_PAGE}{promotion['productSlug']}"
+
+        promotion["thumbnail"] = promotion["keyImages"][-1]["url"]
+        _promotions.append(from_dict_to_model(Game, promotion))
+
+    return _promotions
+
+
+def parse_order_history(data: dict) -> List[CompletedOrder]:
+    completed_orders: List[CompletedOrder] = []
+
+    for order in data["orders"]:
+        if order["orderType"] != "PURCHASE":
+            continue
+        for item in order["items"]:
+            if len(item["namespace"]) != 32:
+                continue
+            completed_orders.append(from_dict_to_model(CompletedOrder, item))
+
+    return completed_orders
+
+
+@retry(
+    retry=retry_if_exception_type(httpx.RequestError),
+    wait=wait_random_exponential(),
+    stop=(stop_after_delay(30) | stop_after_attempt(3)),
+    reraise=True,
+)
+def get_promotions() -> List[Game]:
+    """
+    获取周免游戏数据
+
+    <即将推出> promotion["promotions"]["upcomingPromotionalOffers"]
+    <本周免费> promotion["promotions"]["promotionalOffers"]
+    :return: {"pageLink1": "pageTitle1", "pageLink2": "pageTitle2", ...}
+    """
+    if promotions_cache.fresh:
+        return promotions_cache.games()
+
+    params = {"local": "en-US"}
+
+    with httpx.Client(params=params, headers=DEFAULT_HEADERS, http2=True) as client:
+        resp = client.get(URL_PROMOTIONS)
+
+    try:
+        return parse_promotions(resp.json())
+    except JSONDecodeError as err:
+        logger.error("Failed to get promotions", err=err)
+
+    return []
+
+
+@dataclass
+class PromotionsCache:
+    """
+    freeGamesPromotions shared by every account and every run
+
+    - The entry lives until the next promotion window, i.e. the nearest
+      endDate / upcoming startDate in the feed, clamped to [min_ttl, max_ttl]
+    - Expired entries are revalidated with If-None-Match / If-Modified-Since
+    - Concurrent callers are coalesced into a single request
+    - The entry lives in the state store, every process sharing it sees the same feed
+    """
+
+    key: str = "freeGamesPromotions"
+    min_ttl: int = 600
+    max_ttl: int = 86400
+
+    _entry: Dict[str, Any] = field(default_factory=dict)
+    _games: List[Game] = field(default_factory=list)
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    @staticmethod
+    def _parse_date(value: str | None) -> float | None:
+        with suppress(TypeError, ValueError):
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+    def boundaries(self, data: dict) -> List[float]:
+        """Timestamps at which the free games change: current endDate, upcoming startDate"""
+        boundaries = []
+        with suppress(KeyError, TypeError):
+            for e in data["data"]["Catalog"]["searchStore"]["elements"]:
+                promotions = e.get("promotions") or {}
+                for group in promotions.get("promotionalOffers") or []:
+                    for offer in group.get("promotionalOffers") or []:
+                        boundaries.append(self._parse_date(offer.get("endDate")))
+                for group in promotions.get("upcomingPromotionalOffers") or []:
+                    for offer in group.get("promotionalOffers") or []:
+                        boundaries.append(self._parse_date(offer.get("startDate")))
+        return sorted(b for b in boundaries if b)
+
+    def next_window(self, now: float | None = None) -> float | None:
+        """When the next promotion window opens according to the current entry"""
+        now = now or time.time()
+        return next((b for b in self.boundaries(self.data) if b > now), None)
+
+    def ttl(self, data: dict, now: float | None = None) -> int:
+        now = now or time.time()
+        boundaries = [b for b in self.boundaries(data) if b > now]
+        ttl = min(boundaries) - now if boundaries else self.min_ttl
+        return int(min(max(ttl, self.min_ttl), self.max_ttl))
+
+    def _load(self) -> Dict[str, Any]:
+        if not self._entry:
+            self._entry = get_store().get_entry(self.key)
+        return self._entry
+
+    async def _store(self, entry: Dict[str, Any]):
+        self._entry = entry
+        self._games = []
+        store = get_store()
+        await store.awrite(store.put_entry, self.key, entry)
+
+    @property
+    def fresh(self) -> bool:
+        return self._load().get("expires_at", 0) > time.time()
+
+    def games(self) -> List[Game]:
+        if not self._games and self._load().get("data"):
+            self._games = parse_promotions(copy.deepcopy(self._entry["data"]))
+        return self._games
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        """Raw feed of the current entry, including upcomingPromotionalOffers"""
+        return self._load().get("data", {})
+
+    async def get(self) -> List[Game]:
+        if self.fresh:
+            return self.games()
+
+        async with self._lock:
+            # Another caller, or another process, may have refreshed the entry while we waited
+            self._entry, self._games = {}, []
+            if self.fresh:
+                return self.games()
+            try:
+                await self._revalidate()
+            except (httpx.HTTPError, JSONDecodeError, KeyError) as err:
+                if not self._load().get("data"):
+                    raise
+                logger.warning("Serve stale promotions", err=err)
+
+        return self.games()
+
+    async def _revalidate(self):
+        entry = self._load()
+        headers = {}
+        if entry.get("etag"):
+            headers["if-none-match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["if-modified-since"] = entry["last_modified"]
+
+        resp = await _afetch_promotions(headers)
+        if resp.status_code == 304 and entry.get("data"):
+            entry = {**entry, "expires_at": time.time() + self.ttl(entry["data"])}
+            await self._store(entry)
+            logger.debug("Promotions not modified", expires_at=int(entry["expires_at"]))
+            return
+
+        resp.raise_for_status()
+        data = resp.json()
+        games = parse_promotions(copy.deepcopy(data))
+        await self._store(
+            {
+                "data": data,
+                "etag": resp.headers.get("etag", ""),
+                "last_modified": resp.headers.get("last-modified", ""),
+                "expires_at": time.time() + self.ttl(data),
+            }
+        )
+        self._games = games
+        logger.debug("Promotions refreshed", expires_at=int(self._entry["expires_at"]))
+
+
+@retry(
+    retry=retry_if_exception_type(httpx.RequestError) & retry_if_not_exception_type(CircuitOpen),
+    wait=wait_random_exponential(),
+    stop=(stop_after_delay(30) | stop_after_attempt(3)),
+    reraise=True,
+)
+async def _afetch_promotions(headers: Dict[str, str] | None = None) -> httpx.Response:
+    return await get_client().get(URL_PROMOTIONS, params={"local": "en-US"}, headers=headers)
+
+
+promotions_cache = PromotionsCache()
+
+
+async def aget_promotions() -> List[Game] | None:
+    """
+    Non-blocking get_promotions, served from the shared promotions cache
+
+    Returns: None if the feed could not be fetched and nothing is cached,
+        an empty list only when there really is no free game
+
+    """
+    try:
+        return await promotions_cache.get()
+    except (httpx.HTTPError, JSONDecodeError, KeyError) as err:
+        logger.error("Failed to get promotions", err=err)
+
+
+def get_order_history(
+    cookies: Dict[str, str], page: str | None = None, last_create_at: str | None = None
+) -> List[CompletedOrder]:
+    """获取最近的订单纪录"""
+
+    @retry(
+        retry=retry_if_exception_type(httpx.RequestError),
+        wait=wait_random_exponential(),
+        stop=(stop_after_delay(30) | stop_after_attempt(3)),
+        reraise=True,
+    )
+    def request_history() -> str | None:
+        resp = client.get(URL_ORDER_HISTORY)
+        if not resp.is_success:
+            raise httpx.RequestError("Failed to get order history, cookie may have expired")
+        return resp.text
+
+    params = {"locale": "zh-CN", "page": page or "0", "latCreateAt": last_create_at or ""}
+
+    try:
+        with httpx.Client(
+            headers=DEFAULT_HEADERS, cookies=cookies, params=params, http2=True
+        ) as client:
+            return parse_order_history(json.loads(request_history()))
+    except (httpx.RequestError, JSONDecodeError, KeyError) as err:
+        logger.warning(err)
+
+    return []
+
+
+@retry(
+    retry=retry_if_exception_type(httpx.RequestError) & retry_if_not_exception_type(CircuitOpen),
+    wait=wait_random_exponential(),
+    stop=(stop_after_delay(30) | stop_after_attempt(3)),
+    reraise=True,
+)
+async def _arequest_order_history(
+    cookies: Dict[str, str], page: str | None = None, last_create_at: str | None = None
+) -> dict:
+    params = {"locale": "zh-CN", "page": page or "0", "latCreateAt": last_create_at or ""}
+    resp = await get_client().get(URL_ORDER_HISTORY, params=params, headers=cookie_header(cookies))
+    if not resp.is_success:
+        raise httpx.RequestError("Failed to get order history, cookie may have expired")
+    return resp.json()
+
+
+async def aget_order_history(
+    cookies: Dict[str, str], page: str | None = None, last_create_at: str | None = None
+) -> List[CompletedOrder]:
+    """Non-blocking get_order_history over the shared AsyncClient"""
+    try:
+        return parse_order_history(await _arequest_order_history(cookies, page, last_create_at))
+    except (httpx.RequestError, JSONDecodeError, KeyError) as err:
+        logger.warning(err)
+
+    return []
+
+
+async def sync_order_history(player: EpicPlayer, *, max_pages: int = 200) -> Library:
+    """
+    Walk ajaxGetOrderHistory page by page and merge purchases into the account's library
+
+    Orders come newest first, the walk stops at the first order that is not newer
+    than the stored `last_create_at`, so a warm index usually costs a single request.
+    Pages are addressed by index only, the latCreateAt cursor is never sent along,
+    otherwise the two would advance the walk twice.
+
+    Args:
+        player:
+        max_pages: Hard stop for the pagination
+
+    Returns: The merged library, may be partial if a request failed or `max_pages`
+        was reached, the watermark then stays where it was
+
+    """
+    library = Library.from_store(player.namespace)
+    watermark = library.last_create_at
+    newest = watermark
+    fetched = 0
+
+    try:
+        for page in range(max_pages):
+            data = await _arequest_order_history(player.cookies, str(page))
+            orders = data.get("orders") or []
+
+            reached_watermark = False
+            for order in orders:
+                create_at = int(order.get("createdAtMillis") or 0)
+                if watermark and create_at and create_at <= watermark:
+                    reached_watermark = True
+                    break
+                newest = max(newest, create_at)
+                if order["orderType"] == "PURCHASE":
+                    library.namespaces.update(
+                        i["namespace"] for i in order["items"] if len(i["namespace"]) == 32
+                    )
+
+            fetched += len(orders)
+            if reached_watermark or not orders or fetched >= data.get("total", float("inf")):
+                break
+        else:
+            # The older pages were never fetched, the next sync has to walk them again
+            logger.warning("Order history sync truncated", pages=max_pages, orders=fetched)
+            await library.asave()
+            return library
+    except (httpx.RequestError, JSONDecodeError, KeyError, ValueError) as err:
+        # Keep what we merged, but never move the watermark over a gap
+        logger.warning("Order history sync interrupted", err=err, pages=page)
+        await library.asave()
+        return library
+
+    library.last_create_at = newest
+    await library.asave()
+    logger.debug(
+        "Order history synced",
+        owned=len(library),
+        pages=page + 1,
+        orders=fetched,
+        account=player.namespace,
+    )
+
+    return library
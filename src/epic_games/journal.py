@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/12/4 21:05
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description:
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass
+from typing import Iterable, Dict, Set, Literal
+
+from epic_games.api import Game
+from epic_games.store import get_store
+
+Step = Literal["authorized", "in_cart", "checked_out", "confirmed", "owned"]
+
+# Steps after which a promotion is never touched again in the same window
+DONE_STEPS = frozenset({"confirmed", "owned"})
+
+
+def window_id(promotions: Iterable[Game]) -> str:
+    """A promotion window is identified by the set of free games it offers"""
+    namespaces = sorted({p.namespace for p in promotions})
+    return hashlib.sha1(",".join(namespaces).encode()).hexdigest()[:16]
+
+
+@dataclass
+class ClaimJournal:
+    """
+    Append-only progress of one account in one promotion window
+
+    Every step is committed before the claim moves on, a run killed at any point
+    (OOM, Firefox crash, timeout) leaves the journal at the last completed step:
+
+    - authorized: the run had to sign in again, for the record only. A rerun decides
+      whether to log in from the session check of the preflight, not from this step
+    - in_cart / checked_out: the promotion reached the cart / the payment button was clicked
+    - confirmed: the store redirected to URL_CART_SUCCESS or the download page
+    - owned: the order history already had the promotion
+
+    A rerun skips confirmed and owned promotions, and the whole account once
+    every promotion of the window is done.
+    """
+
+    account: str
+    window: str
+
+    @classmethod
+    def for_promotions(cls, account: str, promotions: Iterable[Game]) -> ClaimJournal:
+        return cls(account=account, window=window_id(promotions))
+
+    def record(self, step: Step, promotions: Iterable[Game] = ()):
+        namespaces = [p.namespace for p in promotions] or [""]
+        get_store().append_journal(self.account, self.window, step, namespaces)
+
+    async def arecord(self, step: Step, promotions: Iterable[Game] = ()):
+        """`record` off the event loop, the step is still committed when it returns"""
+        namespaces = [p.namespace for p in promotions] or [""]
+        store = get_store()
+        await store.awrite(store.append_journal, self.account, self.window, step, namespaces)
+
+    def steps(self) -> Dict[str, str]:
+        """namespace -> last step reached, '' for the account-level steps"""
+        return dict(get_store().journal(self.account, self.window))
+
+    def done(self) -> Set[str]:
+        return {
+            n for n, step in get_store().journal(self.account, self.window) if step in DONE_STEPS
+        }
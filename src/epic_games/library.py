@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/11/24 14:37
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description:
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import Set
+
+from epic_games.store import get_store
+
+
+@dataclass
+class Library:
+    """
+    Owned namespaces of an account, persisted in the state store
+
+    `last_create_at` is the createdAt of the newest order already merged,
+    the next sync only walks the pages above it.
+    """
+
+    account: str
+    namespaces: Set[str] = field(default_factory=set)
+    last_create_at: int = 0
+    updated_at: int = 0
+
+    @classmethod
+    def from_store(cls, account: str) -> Library:
+        store = get_store()
+        last_create_at, updated_at = store.library_sync(account)
+        return cls(
+            account=account,
+            namespaces=store.owned(account),
+            last_create_at=last_create_at,
+            updated_at=updated_at,
+        )
+
+    def __contains__(self, namespace: str) -> bool:
+        return namespace in self.namespaces
+
+    def __len__(self):
+        return len(self.namespaces)
+
+    def save(self):
+        self.updated_at = int(time.time())
+        get_store().save_library(
+            self.account, self.namespaces, self.last_create_at, self.updated_at
+        )
+
+    async def asave(self):
+        """`save` off the event loop"""
+        self.updated_at = int(time.time())
+        store = get_store()
+        await store.awrite(
+            store.save_library,
+            self.account,
+            set(self.namespaces),
+            self.last_create_at,
+            self.updated_at,
+        )
@@ -6,18 +6,22 @@
 from __future__ import annotations
 
 import abc
-import json
 import time
 from abc import ABC
 from contextlib import suppress
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Any
 from typing import Literal
 
 import httpx
+from loguru import logger
 
-from settings import config, project
+from epic_games.store import get_store, storage_cookies
+from settings import get_config, project
+from utils import get_client, cookie_header
+
+SessionStatus = Literal["valid", "expired", "unknown"]
 
 
 @dataclass
@@ -30,15 +34,9 @@ class EpicCookie:
     URL_VERIFY_COOKIES = "https://www.epicgames.com/account/personal"
 
     @classmethod
-    def from_state(cls, fp: Path):
-        """Jsonify cookie from Playwright"""
-        cookies = {}
-        try:
-            data = json.loads(fp.read_text())["cookies"]
-            cookies = {ck["name"]: ck["value"] for ck in data}
-        except (FileNotFoundError, KeyError):
-            pass
-        return cls(cookies=cookies)
+    def from_store(cls, account: str):
+        """Cookies of the storage_state saved last for the account"""
+        return cls(cookies=get_store().cookies(account))
 
     def is_available(self) -> bool | None:
         if not self.cookies:
@@ -51,13 +49,39 @@ class EpicCookie:
             resp = httpx.get(self.URL_VERIFY_COOKIES, headers=headers, cookies=self.cookies)
             return resp.status_code == 200
 
-    def reload(self, fp: Path) -> Dict[str, str] | None:
+    async def acheck(self) -> SessionStatus:
+        """
+        Ask the account page whether the session still signs in
+
+        Returns:
+            valid: 200
+            expired: no cookies, 401 / 403 or a redirect to the login page
+            unknown: the question could not be answered (network, 429, 5xx)
+
+        """
+        if not self.cookies:
+            return "expired"
+        headers = {
+            "origin": "https://store.epicgames.com/zh-CN/p/orwell-keeping-an-eye-on-you",
+            **cookie_header(self.cookies),
+        }
         try:
-            data = json.loads(fp.read_text())["cookies"]
-            self.cookies = {ck["name"]: ck["value"] for ck in data}
-            return self.cookies
-        except (FileNotFoundError, KeyError):
-            pass
+            resp = await get_client().get(
+                self.URL_VERIFY_COOKIES, headers=headers, timeout=httpx.Timeout(10, connect=5)
+            )
+        except httpx.TransportError:
+            return "unknown"
+        if resp.status_code == 200:
+            return "valid"
+        if resp.status_code in (401, 403) or resp.is_redirect:
+            return "expired"
+        return "unknown"
+
+    async def ais_available(self) -> bool | None:
+        """Non-blocking is_available over the shared AsyncClient, None if it cannot be told"""
+        if not self.cookies:
+            return
+        return {"valid": True, "expired": False}.get(await self.acheck())
 
 
 @dataclass
@@ -78,14 +102,13 @@ class Player(ABC):
     Mount user cache
     - database
     - user_data_dir
+        - state.db # sessions, libraries, promotions and claims of every account
         - games@email # runtime user_data_dir
             - context
             - record
                 - captcha.mp4
                 - eg-record.har
-            - ctx_cookie.json
             - ctx_store.json
-            - order_history.json
         - unreal@email
             - context
             - record
@@ -96,8 +119,7 @@ class Player(ABC):
     """
 
     def __post_init__(self):
-        namespace = f"{self.mode}@{self.email.split('@')[0]}"
-        self.user_data_dir = self.user_data_dir.joinpath(namespace)
+        self.user_data_dir = self.user_data_dir.joinpath(self.namespace_of(self.mode, self.email))
         for ck in ["browser_context", "record"]:
             ckp = self.user_data_dir.joinpath(ck)
             ckp.mkdir(parents=True, exist_ok=True)
@@ -107,6 +129,15 @@ class Player(ABC):
     def from_account(cls, *args, **kwargs):
         raise NotImplementedError
 
+    @staticmethod
+    def namespace_of(mode: str, email: str) -> str:
+        """user_data_dir name and state store key of an account, only the local part counts"""
+        return f"{mode}@{email.split('@')[0]}"
+
+    @property
+    def namespace(self) -> str:
+        return self.user_data_dir.name
+
     @property
     def browser_context_dir(self) -> Path:
         return self.user_data_dir.joinpath("browser_context")
@@ -119,8 +150,40 @@ class Player(ABC):
     def record_har_path(self) -> Path:
         return self.record_dir.joinpath(f"eg-{int(time.time())}.har")
 
+    def prune_records(self, keep: int = 0, max_bytes: int = 0) -> int:
+        """
+        Retention of record_dir, oldest files go first
+
+        Args:
+            keep: Newest HAR files and videos kept of each kind, 0 for no limit
+            max_bytes: Upper bound of the whole record_dir, 0 for no limit
+
+        Returns: Number of files removed
+
+        """
+        files = sorted(
+            (fp for fp in self.record_dir.iterdir() if fp.is_file()),
+            key=lambda fp: fp.stat().st_mtime,
+            reverse=True,
+        )
+        doomed = []
+        if keep:
+            for suffix in {fp.suffix for fp in files}:
+                doomed.extend([fp for fp in files if fp.suffix == suffix][keep:])
+        if max_bytes:
+            total = 0
+            for fp in files:
+                total += fp.stat().st_size
+                if total > max_bytes and fp not in doomed:
+                    doomed.append(fp)
+
+        for fp in doomed:
+            fp.unlink(missing_ok=True)
+        return len(doomed)
+
     @property
     def ctx_cookie_path(self) -> Path:
+        """Legacy storage_state file, imported into the state store on first use"""
         return self.user_data_dir.joinpath("ctx_cookie.json")
 
 
@@ -130,24 +193,77 @@ class EpicPlayer(Player):
 
     def __post_init__(self):
         super().__post_init__()
-        self._ctx_cookies = EpicCookie.from_state(fp=self.ctx_cookie_path)
+        get_store().import_legacy(self.namespace, self.ctx_cookie_path, self.order_history_path)
+        self._ctx_cookies = EpicCookie.from_store(self.namespace)
 
     @classmethod
     def from_account(cls):
+        config = get_config()
         return cls(email=config.epic_email, password=config.epic_password, mode="epic-games")
 
+    @classmethod
+    def from_accounts(cls) -> List[EpicPlayer]:
+        """
+        The primary account followed by `config.accounts`, one player per email
+
+        Two emails with the same local part (alice@gmail.com, alice@outlook.com) would
+        share one user_data_dir and one set of store rows, the later one is rejected.
+        """
+        config = get_config()
+        accounts = [(config.epic_email, config.epic_password)]
+        accounts.extend((a["epic_email"], a["epic_password"]) for a in config.accounts)
+
+        players: Dict[str, EpicPlayer] = {}
+        emails: Dict[str, str] = {}
+        for email, password in accounts:
+            if not email:
+                continue
+            namespace = cls.namespace_of("epic-games", email)
+            if namespace not in emails:
+                emails[namespace] = email
+                players[namespace] = cls(email=email, password=password, mode="epic-games")
+            elif emails[namespace] != email:
+                logger.error(
+                    "Skip account",
+                    reason="Its namespace is taken by another email",
+                    email=email,
+                    namespace=namespace,
+                    taken_by=emails[namespace],
+                )
+
+        return list(players.values())
+
     @property
     def ctx_store_path(self) -> Path:
         return self.user_data_dir.joinpath("ctx_store.json")
 
     @property
     def order_history_path(self) -> Path:
+        """Legacy library file, imported into the state store on first use"""
         return self.user_data_dir.joinpath("order_history.json")
 
     @property
     def ctx_cookies(self) -> EpicCookie:
         return self._ctx_cookies
 
+    @property
+    def storage_state(self) -> Dict[str, Any] | None:
+        """Playwright storage_state saved last, None if the account never signed in"""
+        return get_store().load_session(self.namespace)
+
+    def save_state(self, state: Dict[str, Any]) -> Dict[str, str]:
+        """Persist the storage_state of a signed-in context and use its cookies from now on"""
+        get_store().save_session(self.namespace, state)
+        self.cookies = storage_cookies(state)
+        return self.cookies
+
+    async def asave_state(self, state: Dict[str, Any]) -> Dict[str, str]:
+        """`save_state` off the event loop"""
+        store = get_store()
+        await store.awrite(store.save_session, self.namespace, state)
+        self.cookies = storage_cookies(state)
+        return self.cookies
+
     @property
     def cookies(self) -> Dict[str, str]:
         return self._ctx_cookies.cookies
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/12/5 20:31
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description: Session checks of many accounts at once and their refresh before expiry
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import Counter
+from contextlib import suppress
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Awaitable, Callable
+
+from loguru import logger
+
+from epic_games.player import EpicPlayer, SessionStatus
+from epic_games.store import get_store
+
+# Cookies that carry the sign-in, the session ends with the first of them to expire
+AUTH_COOKIES = ("EPIC_SESSION_AP", "EPIC_BEARER_TOKEN", "EPIC_SSO_RM")
+
+
+def session_expiry(state: Dict[str, Any] | None) -> float:
+    """Earliest expiry of the auth cookies of a Playwright storage_state, 0 if there is none"""
+    with suppress(KeyError, TypeError):
+        expires = [ck.get("expires", -1) for ck in state["cookies"] if ck["name"] in AUTH_COOKIES]
+        return min((e for e in expires if e > 0), default=0)
+    return 0
+
+
+async def validate_sessions(
+    players: List[EpicPlayer], *, concurrency: int = 32
+) -> Dict[str, SessionStatus]:
+    """
+    Classify the stored session of every player as valid, expired or unknown
+
+    All checks share the pooled HTTP/2 client, at most `concurrency` are in flight.
+    Only expired sessions need the browser login, unknown ones are left to the
+    in-browser prelude.
+
+    Returns: account -> status
+
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _check(player: EpicPlayer):
+        async with semaphore:
+            return player.namespace, await player.ctx_cookies.acheck()
+
+    start = time.perf_counter()
+    statuses: Dict[str, SessionStatus] = dict(await asyncio.gather(*[_check(p) for p in players]))
+
+    counts = Counter(statuses.values())
+    logger.info(
+        "validate_sessions",
+        valid=counts["valid"],
+        expired=[a for a, s in statuses.items() if s == "expired"],
+        unknown=[a for a, s in statuses.items() if s == "unknown"],
+        elapsed=f"{(time.perf_counter() - start) * 1000:.0f}ms",
+    )
+    return statuses
+
+
+@dataclass
+class SessionRefresher:
+    """
+    Sign in again, while nothing else runs, for the sessions about to expire
+
+    The expiry comes from the storage_state saved by flush_token, no request is made
+    to find the due sessions. Sessions without a known expiry (only session cookies,
+    or none saved) are checked over HTTP with `validate_sessions` instead, only the
+    expired ones are signed in again. Logins are rate limited: at most `max_logins` per round,
+    `spacing` seconds apart, and an account is tried again `min_interval` seconds
+    after its last attempt at the earliest, successful or not.
+    """
+
+    horizon: float = 2 * 86400
+    """
+    Refresh the sessions expiring within this many seconds
+    """
+
+    max_logins: int = 2
+    spacing: float = 60
+    min_interval: float = 6 * 3600
+
+    _attempts: Dict[str, float] = field(default_factory=dict)
+
+    def _may_retry(self, player: EpicPlayer, now: float) -> bool:
+        return now - self._attempts.get(player.namespace, 0) >= self.min_interval
+
+    def due(self, players: List[EpicPlayer], now: float | None = None) -> List[EpicPlayer]:
+        """Players whose known session end is before now + horizon, the soonest first"""
+        now = now or time.time()
+        expiry = get_store().cookie_expiry(AUTH_COOKIES)
+        due = [
+            p
+            for p in players
+            if 0 < expiry.get(p.namespace, 0) < now + self.horizon and self._may_retry(p, now)
+        ]
+        return sorted(due, key=lambda p: expiry[p.namespace])
+
+    def unknown(self, players: List[EpicPlayer], now: float | None = None) -> List[EpicPlayer]:
+        """Players whose session end is not known from the stored cookies"""
+        now = now or time.time()
+        expiry = get_store().cookie_expiry(AUTH_COOKIES)
+        return [p for p in players if not expiry.get(p.namespace) and self._may_retry(p, now)]
+
+    async def expired(self, players: List[EpicPlayer]) -> List[EpicPlayer]:
+        """Sessions of unknown expiry that the account page no longer accepts"""
+        if not (unknown := self.unknown(players)):
+            return []
+        statuses = await validate_sessions(unknown)
+        return [p for p in unknown if statuses.get(p.namespace) == "expired"]
+
+    async def refresh(
+        self,
+        players: List[EpicPlayer],
+        login: Callable[[EpicPlayer], Awaitable[bool | None]],
+        *,
+        deadline: float | None = None,
+    ) -> Dict[str, bool]:
+        """
+        Refresh up to `max_logins` due sessions, one after the other
+
+        Args:
+            players:
+            login: Signs the player in and saves the new storage_state
+            deadline: No login is started after this timestamp, e.g. the next window
+
+        Returns: account -> refreshed
+
+        """
+        # Sessions that are already over come before the ones about to end
+        due = await self.expired(players) + self.due(players)
+
+        results: Dict[str, bool] = {}
+        for player in due[: self.max_logins]:
+            if results:
+                await asyncio.sleep(self.spacing)
+            if deadline and time.time() >= deadline:
+                break
+            self._attempts[player.namespace] = time.time()
+            with logger.contextualize(account=player.namespace):
+                try:
+                    results[player.namespace] = bool(await login(player))
+                except Exception as err:
+                    logger.warning("Failed to refresh session", err=err)
+                    results[player.namespace] = False
+
+        if results:
+            logger.info(
+                "refresh_sessions",
+                refreshed=[a for a, ok in results.items() if ok],
+                failed=[a for a, ok in results.items() if not ok],
+            )
+        return results
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/12/3 18:22
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description: Embedded state of every account, one SQLite file for the whole deployment
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, suppress
+from dataclasses import dataclass, field
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Dict, Any, Callable, Iterable, List, Set, Tuple
+
+from settings import project
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    account       TEXT PRIMARY KEY,
+    storage_state TEXT NOT NULL,
+    updated_at    REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cookies (
+    account TEXT NOT NULL,
+    domain  TEXT NOT NULL,
+    name    TEXT NOT NULL,
+    value   TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (account, domain, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cookies_expires ON cookies (expires);
+CREATE TABLE IF NOT EXISTS library (
+    account   TEXT NOT NULL,
+    namespace TEXT NOT NULL,
+    PRIMARY KEY (account, namespace)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS library_namespace ON library (namespace);
+CREATE TABLE IF NOT EXISTS library_sync (
+    account        TEXT PRIMARY KEY,
+    last_create_at INTEGER NOT NULL,
+    updated_at     INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    key        TEXT PRIMARY KEY,
+    value      TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS claims (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    account    TEXT NOT NULL,
+    namespace  TEXT NOT NULL,
+    success    INTEGER NOT NULL,
+    elapsed    REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS claims_account ON claims (account, created_at);
+CREATE INDEX IF NOT EXISTS claims_namespace ON claims (namespace, account);
+CREATE TABLE IF NOT EXISTS journal (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    account    TEXT NOT NULL,
+    window     TEXT NOT NULL,
+    namespace  TEXT NOT NULL,
+    step       TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS journal_account ON journal (account, window);
+"""
+
+
+def storage_cookies(state: Dict[str, Any] | None) -> Dict[str, str]:
+    """name -> value of a Playwright storage_state, the way they go into a Cookie header"""
+    with suppress(KeyError, TypeError):
+        return {ck["name"]: ck["value"] for ck in state["cookies"]}
+    return {}
+
+
+@dataclass
+class StateStore:
+    """
+    Sessions, owned namespaces, shared cache entries, claim outcomes and the claim journal
+    of every account
+
+    - WAL journal, readers never block the writer and a crash never leaves a torn file
+    - Writes go through BEGIN IMMEDIATE, several processes may share the file,
+      a writer waits up to `timeout` seconds for another one instead of failing
+    - Writes have a connection and a lock of their own, a writer stuck behind another
+      process never holds up the reads. Coroutines hand writes to a worker thread with
+      `awrite`, only the short reads run on the event loop
+    - The browser profile of the persistent mode stays on disk, it is not state we parse
+    """
+
+    path: Path
+    timeout: float = 30
+
+    _conn: sqlite3.Connection | None = None
+    _writer: sqlite3.Connection | None = None
+    _lock: threading.RLock = field(default_factory=threading.RLock)
+    _write_lock: threading.RLock = field(default_factory=threading.RLock)
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Connection of the reads"""
+        # The schema is in place before the first read
+        self.writer
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+            return self._conn
+
+    @property
+    def writer(self) -> sqlite3.Connection:
+        """Connection of the transactions, never waits for a transaction once it is open"""
+        if self._writer is None:
+            with self._write_lock:
+                if self._writer is None:
+                    writer = self._connect()
+                    writer.executescript(SCHEMA)
+                    self._writer = writer
+        return self._writer
+
+    @contextmanager
+    def transaction(self):
+        with self._write_lock:
+            conn = self.writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    async def awrite(self, write: Callable[..., Any], *args) -> Any:
+        """
+        Run one of the write methods on a worker thread
+
+        BEGIN IMMEDIATE may wait up to `timeout` seconds for another process,
+        the event loop keeps serving the other accounts meanwhile.
+
+        Examples:
+            await store.awrite(store.record_claim, account, namespaces, True, elapsed)
+        """
+        return await asyncio.to_thread(write, *args)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def _query(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    # Sessions
+
+    def load_session(self, account: str) -> Dict[str, Any] | None:
+        """The storage_state saved last for the account, None if it never signed in"""
+        if rows := self._query("SELECT storage_state FROM sessions WHERE account = ?", (account,)):
+            with suppress(JSONDecodeError):
+                return json.loads(rows[0][0])
+
+    def save_session(self, account: str, state: Dict[str, Any]):
+        cookies = [
+            (account, ck.get("domain", ""), ck["name"], ck["value"], ck.get("expires", -1))
+            for ck in state.get("cookies", [])
+        ]
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (account, json.dumps(state), time.time()),
+            )
+            conn.execute("DELETE FROM cookies WHERE account = ?", (account,))
+            conn.executemany("INSERT OR REPLACE INTO cookies VALUES (?, ?, ?, ?, ?)", cookies)
+
+    def cookies(self, account: str) -> Dict[str, str]:
+        rows = self._query("SELECT name, value FROM cookies WHERE account = ?", (account,))
+        return {name: value for name, value in rows}
+
+    def cookie_expiry(self, names: Iterable[str]) -> Dict[str, float]:
+        """account -> earliest expiry of the named cookies, session cookies (-1) are left out"""
+        names = list(names)
+        return dict(
+            self._query(
+                "SELECT account, MIN(expires) FROM cookies"
+                f" WHERE name IN ({', '.join('?' * len(names))}) AND expires > 0"
+                " GROUP BY account",
+                tuple(names),
+            )
+        )
+
+    # Library
+
+    def owned(self, account: str) -> Set[str]:
+        rows = self._query("SELECT namespace FROM library WHERE account = ?", (account,))
+        return {r[0] for r in rows}
+
+    def owns(self, account: str, namespace: str) -> bool:
+        return bool(
+            self._query(
+                "SELECT 1 FROM library WHERE account = ? AND namespace = ?", (account, namespace)
+            )
+        )
+
+    def library_sync(self, account: str) -> Tuple[int, int]:
+        """(last_create_at, updated_at) of the last order history sync"""
+        rows = self._query(
+            "SELECT last_create_at, updated_at FROM library_sync WHERE account = ?", (account,)
+        )
+        return rows[0] if rows else (0, 0)
+
+    def save_library(
+        self, account: str, namespaces: Iterable[str], last_create_at: int, updated_at: int
+    ):
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO library VALUES (?, ?)", [(account, n) for n in namespaces]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO library_sync VALUES (?, ?, ?)",
+                (account, last_create_at, updated_at),
+            )
+
+    # Shared entries, e.g. the promotions feed
+
+    def get_entry(self, key: str) -> Dict[str, Any]:
+        if rows := self._query("SELECT value FROM entries WHERE key = ?", (key,)):
+            with suppress(JSONDecodeError):
+                return json.loads(rows[0][0])
+        return {}
+
+    def put_entry(self, key: str, value: Dict[str, Any]):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time()),
+            )
+
+    # Claim outcomes
+
+    def record_claim(self, account: str, namespaces: Iterable[str], success: bool, elapsed: float):
+        """One row per promotion of the run, a run with nothing left to claim records ''"""
+        now = time.time()
+        rows = [(account, n, int(success), elapsed, now) for n in (list(namespaces) or [""])]
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO claims (account, namespace, success, elapsed, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def claims(self, account: str, limit: int = 20) -> List[Dict[str, Any]]:
+        rows = self._query(
+            "SELECT namespace, success, elapsed, created_at FROM claims"
+            " WHERE account = ? ORDER BY created_at DESC LIMIT ?",
+            (account, limit),
+        )
+        return [
+            {"namespace": n, "success": bool(s), "elapsed": e, "created_at": c}
+            for n, s, e, c in rows
+        ]
+
+    # Claim journal, rows are only ever appended
+
+    def append_journal(self, account: str, window: str, step: str, namespaces: Iterable[str]):
+        now = time.time()
+        rows = [(account, window, n, step, now) for n in namespaces]
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO journal (account, window, namespace, step, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def journal(self, account: str, window: str) -> List[Tuple[str, str]]:
+        """(namespace, step) of the account in the window, oldest first"""
+        return self._query(
+            "SELECT namespace, step FROM journal WHERE account = ? AND window = ? ORDER BY id",
+            (account, window),
+        )
+
+    # Migration
+
+    def import_legacy(self, account: str, ctx_cookie_path: Path, order_history_path: Path):
+        """Take over ctx_cookie.json and order_history.json of an account the store does not know"""
+        if not self.load_session(account):
+            with suppress(FileNotFoundError, JSONDecodeError, KeyError, TypeError):
+                self.save_session(account, json.loads(ctx_cookie_path.read_text()))
+        if self.library_sync(account) == (0, 0):
+            with suppress(FileNotFoundError, JSONDecodeError, TypeError, ValueError):
+                data = json.loads(order_history_path.read_text())
+                self.save_library(
+                    account,
+                    data.get("namespaces", []),
+                    int(data.get("last_create_at", 0)),
+                    int(data.get("updated_at", 0)),
+                )
+
+
+_store: StateStore | None = None
+
+
+def get_store() -> StateStore:
+    """One StateStore per process, user_data_dir/state.db"""
+    global _store
+    if _store is None:
+        _store = StateStore(path=project.user_data_dir.joinpath("state.db"))
+    return _store
+
+
+def set_store(store: StateStore | None):
+    """Use another database, for benchmarks and scripts"""
+    global _store
+    if _store is not None and _store is not store:
+        _store.close()
+    _store = store
@@ -16,9 +16,10 @@ from hcaptcha_challenger import install
 from hcaptcha_challenger.agents import Malenia
 from loguru import logger
 from playwright.async_api import BrowserContext, async_playwright, Response, Page
-from tenacity import *
 
 from middleware.epic_search_store_query import SearchStoreQuery
+from settings import init_logger
+from utils import wait_latest
 from epic_games import (
     EpicPlayer,
     EpicGames,
@@ -66,14 +67,8 @@ class RuYuan:
             except Exception as err:
                 logger.exception(err)
 
-    @retry(
-        retry=retry_if_exception_type(asyncio.QueueEmpty),
-        wait=wait_fixed(0.5),
-        stop=(stop_after_delay(30) | stop_after_attempt(60)),
-        reraise=True,
-    )
     async def _reset_state(self):
-        self.task = self.task_queue.get_nowait()
+        self.task = await wait_latest(self.task_queue)
 
     @classmethod
     def from_epic(cls):
@@ -103,9 +98,7 @@ class RuYuan:
             return
 
         self.ctx_cookies_is_available = True
-        await context.storage_state(path=self.player.ctx_cookie_path)
-        cookies = self.player.ctx_cookies.reload(self.player.ctx_cookie_path)
-        self.player.cookies = cookies
+        await self.player.asave_state(await context.storage_state())
 
         page.on("response", self.handler)
         ssq = SearchStoreQuery()
@@ -198,4 +191,5 @@ async def run():
 
 
 if __name__ == "__main__":
+    init_logger()
     asyncio.run(run())
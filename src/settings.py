@@ -3,16 +3,27 @@
 # Author     : QIN2DIM
 # Github     : https://github.com/QIN2DIM
 # Description:
+from __future__ import annotations
+
 import json
 import os
 import sys
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List
+from typing import List, Dict
+
+from loguru import logger
 
 from utils import init_log
 
 
+def as_bool(value) -> bool:
+    """Flag from config.json or the environment, where "0" and "false" must mean False"""
+    if isinstance(value, str):
+        return value.strip().lower() in {"1", "true", "yes", "on"}
+    return bool(value)
+
+
 @dataclass
 class Project:
     src_dir = Path(__file__).parent
@@ -23,6 +34,10 @@ class Project:
 
     user_data_dir = root_dir.joinpath("user_data_dir")
 
+    models_dir = user_data_dir.joinpath("models")
+
+    assets_dir = user_data_dir.joinpath("assets")
+
 
 @dataclass
 class Config:
@@ -43,6 +58,69 @@ class Config:
     Set CDN to download AI models from GITHub release
     """
 
+    accounts: List[Dict[str, str]] = field(default_factory=list)
+    """
+    Extra Epic accounts claimed in the same batch
+    [{"epic_email": "", "epic_password": ""}, ...]
+    """
+
+    concurrency: int = 1
+    """
+    Maximum number of accounts claimed at the same time
+    """
+
+    model_refresh_interval: int = 86400
+    """
+    Seconds between two upgrade checks of the captcha models
+    """
+
+    model_offline: bool = False
+    """
+    Never check for model upgrades, use the models already installed
+    """
+
+    max_tabs: int = 1
+    """
+    Product pages prepared in parallel tabs before the checkout
+    """
+
+    block_profile: str = "off"
+    """
+    Requests dropped by the claim browser: off / trackers / lean
+    lean also drops images, media and fonts, captcha and purchase frames are never touched.
+    Playwright may skip its HTTP cache while a route is registered, trackers only routes
+    the tracker hosts, lean has to route every request. The "Route profile" log line
+    puts cacheable_bytes (downloaded although cacheable) against the estimated saving
+    """
+
+    asset_cache_size: int = 0
+    """
+    MB of immutable static assets (store bundles, hCaptcha assets) shared on disk by
+    every account and run, 0 disables the cache
+    """
+
+    record_mode: str = "always"
+    """
+    HAR and video recording: off / on-failure / always
+    on-failure records into a scratch dir and keeps the files only if the claim fails
+    """
+
+    record_keep: int = 20
+    """
+    Newest recordings of each kind kept per account, 0 for no limit
+    """
+
+    record_max_mb: int = 0
+    """
+    Upper bound of the record dir per account in MB, 0 for no limit
+    """
+
+    browser_pool: bool = False
+    """
+    Launch Firefox once per batch and give every account an isolated context
+    loaded from its session in the state store, instead of one persistent launch per account
+    """
+
     @classmethod
     def from_json(cls, config_path: Path):
         try:
@@ -59,12 +137,35 @@ class Config:
             epic_password = os.environ.get("EPIC_PASSWORD", _config.get("epic_password", ""))
             apprise_servers = [os.environ[k] for k in os.environ if k.startswith("APPRISE_")]
             apprise_servers.extend(_config.get("apprise_servers", []))
+            accounts = [
+                {"epic_email": a["epic_email"], "epic_password": a["epic_password"]}
+                for a in _config.get("accounts", [])
+                if a.get("epic_email") and a.get("epic_password")
+            ]
+            concurrency = int(os.environ.get("EPIC_CONCURRENCY", _config.get("concurrency", 1)))
+            browser_pool = as_bool(os.environ.get("EPIC_BROWSER_POOL", _config.get("browser_pool")))
+            model_refresh_interval = int(_config.get("model_refresh_interval", 86400))
+            model_offline = as_bool(
+                os.environ.get("EPIC_MODEL_OFFLINE", _config.get("model_offline"))
+            )
+            max_tabs = int(os.environ.get("EPIC_MAX_TABS", _config.get("max_tabs", 1)))
+            block_profile = os.environ.get(
+                "EPIC_BLOCK_PROFILE", _config.get("block_profile", "off")
+            )
+            asset_cache_size = int(
+                os.environ.get("EPIC_ASSET_CACHE_SIZE", _config.get("asset_cache_size", 0))
+            )
+            record_mode = os.environ.get("EPIC_RECORD_MODE", _config.get("record_mode", "always"))
+            if record_mode not in ("off", "on-failure", "always"):
+                raise ValueError(f"Unknown record_mode {record_mode}")
+            record_keep = int(_config.get("record_keep", 20))
+            record_max_mb = int(_config.get("record_max_mb", 0))
             cdn = (
                 "https://dl.capoo.xyz"
                 if not os.getenv("GITHUB_REPOSITORY") and _config.get("enable_https_cdn")
                 else ""
             )
-        except KeyError:
+        except (KeyError, ValueError):
             sys.exit(1)
 
         return cls(
@@ -72,13 +173,50 @@ class Config:
             epic_password=epic_password,
             apprise_servers=apprise_servers,
             cdn=cdn,
+            accounts=accounts,
+            concurrency=max(1, concurrency),
+            browser_pool=browser_pool,
+            block_profile=block_profile,
+            asset_cache_size=max(0, asset_cache_size),
+            record_mode=record_mode,
+            record_keep=max(0, record_keep),
+            record_max_mb=max(0, record_max_mb),
+            max_tabs=max(1, max_tabs),
+            model_refresh_interval=model_refresh_interval,
+            model_offline=model_offline,
         )
 
 
 project = Project()
-logger = init_log(
-    error=project.logs_dir.joinpath("error.log"),
-    runtime=project.logs_dir.joinpath("runtime.log"),
-    serialize=project.logs_dir.joinpath("serialize.log"),
-)
-config = Config.from_json(project.config_path)
+
+_config: Config | None = None
+
+
+def get_config() -> Config:
+    """Read config.json on first use rather than at import time"""
+    global _config
+    if _config is None:
+        _config = Config.from_json(project.config_path)
+    return _config
+
+
+def set_config(config: Config):
+    """Use `config` instead of config.json, for benchmarks and scripts"""
+    global _config
+    _config = config
+
+
+def init_logger():
+    """Configure the loguru sinks, called by the entry scripts"""
+    return init_log(
+        error=project.logs_dir.joinpath("error.log"),
+        runtime=project.logs_dir.joinpath("runtime.log"),
+        serialize=project.logs_dir.joinpath("serialize.log"),
+    )
+
+
+def __getattr__(name: str):
+    # Keep `from settings import config` working for scripts that still use it
+    if name == "config":
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
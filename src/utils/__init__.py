@@ -3,7 +3,30 @@
 # Author     : QIN2DIM
 # GitHub     : https://github.com/QIN2DIM
 # Description:
-from .common import init_log, from_dict_to_model
-from .solver import AgentG
+from .common import init_log, from_dict_to_model, atomic_write_text, wait_latest
+from .limits import limiter, CircuitOpen
+from .net import get_client, aclose_client, set_transport, cookie_header, DEFAULT_HEADERS
 
-__all__ = ["init_log", "from_dict_to_model", "AgentG"]
+__all__ = [
+    "init_log",
+    "from_dict_to_model",
+    "atomic_write_text",
+    "wait_latest",
+    "AgentG",
+    "get_client",
+    "aclose_client",
+    "set_transport",
+    "cookie_header",
+    "DEFAULT_HEADERS",
+    "limiter",
+    "CircuitOpen",
+]
+
+
+def __getattr__(name: str):
+    # The solver drags in Playwright and hcaptcha-challenger, load it only on the browser path
+    if name == "AgentG":
+        from .solver import AgentG
+
+        return AgentG
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/11/28 0:16
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description:
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from contextlib import suppress
+from dataclasses import dataclass, field
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Dict, Any, Tuple, TYPE_CHECKING
+
+from loguru import logger
+
+from utils.common import atomic_write_text
+
+if TYPE_CHECKING:
+    from playwright.async_api import BrowserContext, Route
+
+CACHEABLE_TYPES = frozenset({"script", "stylesheet", "font", "image"})
+
+# Hop-by-hop or body-encoding headers, the cached body is stored decoded
+DROP_HEADERS = frozenset(
+    {"content-encoding", "content-length", "transfer-encoding", "set-cookie", "date", "age"}
+)
+
+MIN_MAX_AGE = 86400
+
+# Marks the responses served from the cache, they never reached the network
+HIT_HEADER = "x-asset-cache"
+
+
+def is_immutable(headers: Dict[str, str]) -> bool:
+    """Only responses the server itself declares long-lived are shared between accounts"""
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-store" in cache_control or "private" in cache_control:
+        return False
+    if "immutable" in cache_control:
+        return True
+    if m := re.search(r"max-age=(\d+)", cache_control):
+        return int(m.group(1)) >= MIN_MAX_AGE
+    return False
+
+
+@dataclass
+class AssetCache:
+    """
+    Content-addressed cache of immutable static assets, shared by every account
+
+    - objects/<sha256[:2]>/<sha256> holds each distinct body once
+    - index.json maps a URL to its object, headers and last access time
+    - The least recently used URLs are evicted once the objects exceed `max_bytes`
+    - The route handler goes through `aget`/`aput` and the run ends with `aflush`,
+      file IO runs on worker threads and never blocks the event loop of the accounts
+    """
+
+    root: Path
+    max_bytes: int = 256 * 1024 * 1024
+
+    hits: int = 0
+    misses: int = 0
+    stored: int = 0
+    evicted: int = 0
+    hit_bytes: int = 0
+
+    _index: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    _loaded: bool = False
+    _dirty: bool = False
+    _lock: threading.RLock = field(default_factory=threading.RLock)
+
+    @property
+    def index_path(self) -> Path:
+        return self.root.joinpath("index.json")
+
+    def _object_path(self, digest: str) -> Path:
+        return self.root.joinpath("objects", digest[:2], digest)
+
+    def _read_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            return json.loads(self.index_path.read_text(encoding="utf8"))
+        except (FileNotFoundError, JSONDecodeError):
+            return {}
+
+    def _load(self):
+        with self._lock:
+            if not self._loaded:
+                self._index = self._read_index()
+                self._loaded = True
+
+    @property
+    def size(self) -> int:
+        """Bytes of distinct objects, a body shared by several URLs counts once"""
+        self._load()
+        with self._lock:
+            return sum({e["digest"]: e["size"] for e in self._index.values()}.values())
+
+    def get(self, url: str) -> Tuple[Dict[str, str], bytes] | None:
+        self._load()
+        with self._lock:
+            entry = self._index.get(url)
+        if not entry:
+            return
+        try:
+            body = self._object_path(entry["digest"]).read_bytes()
+        except FileNotFoundError:
+            with self._lock:
+                self._index.pop(url, None)
+                self._dirty = True
+            return
+        with self._lock:
+            entry["atime"] = time.time()
+            self._dirty = True
+        return entry["headers"], body
+
+    def put(self, url: str, headers: Dict[str, str], body: bytes):
+        self._load()
+        digest = hashlib.sha256(body).hexdigest()
+        fp = self._object_path(digest)
+        if not fp.exists():
+            fp.parent.mkdir(parents=True, exist_ok=True)
+            # Another thread or process may be writing the same object
+            tmp = fp.with_suffix(f".{threading.get_native_id()}.tmp")
+            tmp.write_bytes(body)
+            tmp.replace(fp)
+        with self._lock:
+            self._index[url] = {
+                "digest": digest,
+                "size": len(body),
+                "atime": time.time(),
+                "headers": {k: v for k, v in headers.items() if k.lower() not in DROP_HEADERS},
+            }
+            self.stored += 1
+            self._dirty = True
+
+    async def aget(self, url: str) -> Tuple[Dict[str, str], bytes] | None:
+        return await asyncio.to_thread(self.get, url)
+
+    async def aput(self, url: str, headers: Dict[str, str], body: bytes):
+        await asyncio.to_thread(self.put, url, headers, body)
+
+    async def aflush(self):
+        await asyncio.to_thread(self.flush)
+
+    def evict(self):
+        """Drop least recently used URLs until the distinct objects fit in `max_bytes`"""
+        self._load()
+        with self._lock:
+            size = self.size
+            if size <= self.max_bytes:
+                return
+
+            refs: Dict[str, int] = {}
+            for entry in self._index.values():
+                refs[entry["digest"]] = refs.get(entry["digest"], 0) + 1
+
+            for url, entry in sorted(self._index.items(), key=lambda kv: kv[1]["atime"]):
+                if size <= self.max_bytes:
+                    break
+                del self._index[url]
+                self.evicted += 1
+                refs[entry["digest"]] -= 1
+                if refs[entry["digest"]] == 0:
+                    with suppress(FileNotFoundError):
+                        self._object_path(entry["digest"]).unlink()
+                    size -= entry["size"]
+            self._dirty = True
+
+    def flush(self):
+        """Merge with entries written by other processes, evict, then persist the index"""
+        with self._lock:
+            if not self._dirty:
+                return
+            for url, entry in self._read_index().items():
+                mine = self._index.get(url)
+                if not mine or mine["atime"] < entry["atime"]:
+                    self._index[url] = entry
+            self.evict()
+            self.root.mkdir(parents=True, exist_ok=True)
+            atomic_write_text(self.index_path, json.dumps(self._index))
+            self._dirty = False
+
+    def report(self):
+        total = self.hits + self.misses
+        logger.info(
+            "Asset cache",
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=f"{self.hits / total:.0%}" if total else "-",
+            hit_bytes=self.hit_bytes,
+            stored=self.stored,
+            evicted=self.evicted,
+            size=self.size,
+        )
+
+
+async def apply_asset_cache(context: BrowserContext, cache: AssetCache):
+    """Serve cacheable static assets of every page in the context from `cache`"""
+
+    async def handle(route: Route):
+        request = route.request
+        if request.method != "GET" or request.resource_type not in CACHEABLE_TYPES:
+            return await route.fallback()
+
+        if cached := await cache.aget(request.url):
+            headers, body = cached
+            cache.hits += 1
+            cache.hit_bytes += len(body)
+            return await route.fulfill(
+                status=200, headers={**headers, HIT_HEADER: "hit"}, body=body
+            )
+
+        cache.misses += 1
+        response = await route.fetch()
+        body = await response.body()
+        if response.status == 200 and is_immutable(response.headers):
+            await cache.aput(request.url, response.headers, body)
+        await route.fulfill(response=response, body=body)
+
+    await context.route("**/*", handle)
@@ -3,8 +3,11 @@
 # Author     : QIN2DIM
 # GitHub     : https://github.com/QIN2DIM
 # Description:
+import asyncio
 import inspect
+import os
 import sys
+from pathlib import Path
 from typing import Dict, Any
 
 from loguru import logger
@@ -62,3 +65,29 @@ def from_dict_to_model(cls, data: Dict[str, Any]):
             for key, val in inspect.signature(cls).parameters.items()
         }
     )
+
+
+def atomic_write_text(fp: Path, text: str):
+    """Write then rename, a crash or a concurrent reader never sees a half-written file"""
+    tmp = fp.with_suffix(f"{fp.suffix}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf8")
+    os.replace(tmp, fp)
+
+
+async def wait_latest(queue: asyncio.Queue, timeout: float = 30):
+    """
+    Wait for the next item without polling, then drain the queue to the most recent one
+
+    Raises:
+        asyncio.QueueEmpty: nothing arrived within `timeout` seconds
+
+    """
+    try:
+        item = await asyncio.wait_for(queue.get(), timeout=timeout)
+    except asyncio.TimeoutError:
+        raise asyncio.QueueEmpty from None
+
+    while not queue.empty():
+        item = queue.get_nowait()
+
+    return item
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/12/6 21:47
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description: Per-endpoint rate limits and circuit breakers shared by every account
+"""
+Every account of the process goes through the same `limiter`:
+
+- A token bucket per endpoint spaces the requests out, retries of many accounts
+  queue up behind each other instead of hitting Epic at the same instant
+- A circuit breaker per endpoint opens after `threshold` failures in a row,
+  callers then get `CircuitOpen` at once until `cooldown` has passed and a single
+  probe request got through
+- 429 and 5xx count as failures, a Retry-After pauses the bucket of the endpoint
+
+HTTP requests of the shared AsyncClient are attributed to an endpoint by URL.
+Browser steps (checkout, challenge) are paced with `limiter.guard(name)` around each
+attempt, the checkout breaker is fed by the HTTP responses of the page through
+`watch_responses`, never by selector timeouts of the UI.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Mapping, Tuple, Type, TYPE_CHECKING
+from urllib.parse import urlsplit
+
+import httpx
+from loguru import logger
+
+from utils.routing import host_matches
+
+if TYPE_CHECKING:
+    from playwright.async_api import Page, Request, Response
+
+# name -> (host, path prefix), the first match wins, other requests are keyed by host
+ENDPOINTS: Dict[str, Tuple[str, str]] = {
+    "promotions": ("store-site-backend-static.ak.epicgames.com", "/freeGamesPromotions"),
+    "order-history": ("www.epicgames.com", "/account/v2/payment/ajaxGetOrderHistory"),
+    "account": ("www.epicgames.com", "/account/"),
+    "graphql": ("store.epicgames.com", "/graphql"),
+}
+
+# name -> (requests per second, burst)
+RATES: Dict[str, Tuple[float, int]] = {
+    "promotions": (2, 5),
+    "order-history": (5, 10),
+    "account": (10, 20),
+    "graphql": (2, 4),
+    "checkout": (0.5, 2),
+    "challenge": (1, 3),
+}
+
+DEFAULT_RATE = (8, 16)
+
+
+class CircuitOpen(httpx.TransportError):
+    """The endpoint failed too often, the request was not sent"""
+
+
+@dataclass
+class TokenBucket:
+    rate: float
+    burst: int
+
+    _tokens = None
+    _updated = None
+
+    def __post_init__(self):
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """
+        Take one token, waiting for it if the bucket is empty
+
+        The token is reserved before the wait, so concurrent callers are served
+        in the order they asked and never all wake up together.
+
+        Returns: Seconds waited
+
+        """
+        self._refill(time.monotonic())
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        delay = -self._tokens / self.rate
+        await asyncio.sleep(delay)
+        return delay
+
+    def pause(self, seconds: float):
+        """Hand out nothing for `seconds`, e.g. the Retry-After of a 429"""
+        self._refill(time.monotonic())
+        self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+@dataclass
+class CircuitBreaker:
+    threshold: int = 5
+    cooldown: float = 30
+
+    failures: int = 0
+    opened_at: float | None = None
+
+    _probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half-open"
+
+    @property
+    def retry_in(self) -> float:
+        if self.opened_at is None:
+            return 0
+        return max(self.cooldown - (time.monotonic() - self.opened_at), 0)
+
+    def allow(self) -> bool:
+        """Closed lets everything through, half-open a single probe at a time"""
+        match self.state:
+            case "closed":
+                return True
+            case "half-open" if not self._probing:
+                self._probing = True
+                return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def failure(self) -> bool:
+        """Returns: True if this failure opened the breaker"""
+        self.failures += 1
+        if self._probing or (self.opened_at is None and self.failures >= self.threshold):
+            self.opened_at = time.monotonic()
+            self._probing = False
+            return True
+        return False
+
+    def release(self):
+        """The probe ended without an answer, e.g. it was cancelled"""
+        self._probing = False
+
+
+@dataclass
+class Endpoint:
+    name: str
+    bucket: TokenBucket
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+
+    requests: int = 0
+    failures: int = 0
+    throttled: int = 0
+    rejected: int = 0
+    opened: int = 0
+    waited: float = 0
+
+    async def enter(self):
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpen(f"{self.name} is failing, retry in {self.breaker.retry_in:.0f}s")
+        self.waited += await self.bucket.acquire()
+        self.requests += 1
+
+    def success(self):
+        self.breaker.success()
+
+    def failure(self, retry_after: float = 0):
+        self.failures += 1
+        if retry_after > 0:
+            self.throttled += 1
+            self.bucket.pause(retry_after)
+        if self.breaker.failure():
+            self.opened += 1
+            logger.warning(
+                "Circuit opened",
+                endpoint=self.name,
+                failures=self.breaker.failures,
+                cooldown=self.breaker.cooldown,
+            )
+
+    def observe(self, status: int, retry_after: float = 0):
+        """Count one response of the endpoint, 429 and 5xx are failures"""
+        if status == 429:
+            # Back off even when Epic does not say for how long
+            self.failure(retry_after=retry_after or 1)
+        elif status >= 500:
+            self.failure(retry_after=retry_after)
+        else:
+            self.success()
+
+    def stats(self) -> Dict[str, int | float | str]:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+            "opened": self.opened,
+            "waited": round(self.waited, 3),
+            "state": self.breaker.state,
+        }
+
+
+@dataclass
+class Limiter:
+    endpoints: Dict[str, Endpoint] = field(default_factory=dict)
+
+    def endpoint(self, name: str) -> Endpoint:
+        if name not in self.endpoints:
+            rate, burst = RATES.get(name, DEFAULT_RATE)
+            self.endpoints[name] = Endpoint(name=name, bucket=TokenBucket(rate=rate, burst=burst))
+        return self.endpoints[name]
+
+    def for_url(self, url: httpx.URL) -> Endpoint:
+        for name, (host, prefix) in ENDPOINTS.items():
+            if url.host == host and url.path.startswith(prefix):
+                return self.endpoint(name)
+        return self.endpoint(url.host)
+
+    @asynccontextmanager
+    async def guard(self, name: str, failures: Tuple[Type[BaseException], ...] = ()):
+        """
+        One attempt of a step that is not a request of the shared client
+
+        Paced by the bucket of `name` and rejected at once while its breaker is open.
+        Only exceptions in `failures` count against the breaker and are re-raised,
+        a body that returns normally closes it again.
+        """
+        endpoint = self.endpoint(name)
+        await endpoint.enter()
+        try:
+            yield endpoint
+        except failures:
+            endpoint.failure()
+            raise
+        except BaseException:
+            endpoint.breaker.release()
+            raise
+        endpoint.success()
+
+    def stats(self) -> Dict[str, Dict[str, int | float | str]]:
+        return {name: e.stats() for name, e in self.endpoints.items()}
+
+    def report(self):
+        for name, s in self.stats().items():
+            logger.info("Endpoint limits", endpoint=name, **s)
+        logger.bind(metric="limits", limits=self.stats()).debug("limits")
+
+    def reset(self):
+        self.endpoints.clear()
+
+
+limiter = Limiter()
+
+
+def _retry_after(headers: Mapping[str, str]) -> float:
+    try:
+        return float(headers.get("retry-after", 0))
+    except ValueError:
+        return 0
+
+
+@contextmanager
+def watch_responses(page: Page, endpoint: Endpoint, hosts: Tuple[str, ...]):
+    """
+    Feed the breaker of `endpoint` with the responses the page gets from `hosts`
+
+    Only the status codes and failed requests count, a selector that times out on
+    a slow page says nothing about the endpoint. Requests aborted on purpose, e.g.
+    by a block profile, are ignored.
+    """
+
+    def on_response(response: Response):
+        if host_matches(urlsplit(response.url).hostname or "", hosts):
+            endpoint.observe(response.status, _retry_after(response.headers))
+
+    def on_request_failed(request: Request):
+        if host_matches(urlsplit(request.url).hostname or "", hosts):
+            if "ABORT" not in (request.failure or "").upper():
+                endpoint.failure()
+
+    page.on("response", on_response)
+    page.on("requestfailed", on_request_failed)
+    try:
+        yield endpoint
+    finally:
+        page.remove_listener("response", on_response)
+        page.remove_listener("requestfailed", on_request_failed)
+
+
+class LimitedTransport(httpx.AsyncBaseTransport):
+    """Every request of the shared client passes the limiter of its endpoint"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, limits: Limiter = limiter):
+        self._transport = transport
+        self._limits = limits
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = self._limits.for_url(request.url)
+        try:
+            await endpoint.enter()
+        except CircuitOpen as err:
+            err.request = request
+            raise
+        try:
+            resp = await self._transport.handle_async_request(request)
+        except httpx.TransportError:
+            endpoint.failure()
+            raise
+        except BaseException:
+            endpoint.breaker.release()
+            raise
+
+        endpoint.observe(resp.status_code, _retry_after(resp.headers))
+        return resp
+
+    async def aclose(self):
+        await self._transport.aclose()
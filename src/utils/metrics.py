@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/11/29 22:31
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description:
+from __future__ import annotations
+
+import math
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from loguru import logger
+
+
+def percentile(samples: List[float], p: float) -> float:
+    """Nearest-rank percentile, p in (0, 1]"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(p * len(ordered)) - 1, 0)]
+
+
+@dataclass
+class Metrics:
+    """
+    Wall-clock spans of the claim stages
+
+    Every span is emitted as a structured record (`metric=span`, `stage`, `elapsed`)
+    which ends up in serialize.log, and kept in memory for the end-of-run summary.
+    """
+
+    samples: Dict[str, List[float]] = field(default_factory=dict)
+
+    def record(self, stage: str, elapsed: float, **extra):
+        self.samples.setdefault(stage, []).append(elapsed)
+        logger.bind(metric="span", stage=stage, elapsed=round(elapsed, 3), **extra).debug("span")
+
+    @contextmanager
+    def span(self, stage: str, **extra):
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(stage, time.perf_counter() - start, ok=ok, **extra)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            stage: {
+                "count": len(samples),
+                "p50": round(percentile(samples, 0.5), 3),
+                "p95": round(percentile(samples, 0.95), 3),
+                "total": round(sum(samples), 3),
+            }
+            for stage, samples in self.samples.items()
+        }
+
+    def report(self):
+        if not self.samples:
+            return
+        summary = self.summary()
+        for stage, s in summary.items():
+            logger.info(
+                "Stage timing",
+                stage=stage,
+                count=s["count"],
+                p50=f"{s['p50']:.2f}s",
+                p95=f"{s['p95']:.2f}s",
+                total=f"{s['total']:.2f}s",
+            )
+        logger.bind(metric="summary", summary=summary).debug("summary")
+
+    def reset(self):
+        self.samples.clear()
+
+
+metrics = Metrics()
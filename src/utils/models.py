@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/11/26 11:48
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description:
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Any, Dict
+
+from loguru import logger
+
+from utils.common import atomic_write_text
+
+
+@dataclass
+class ModelCache:
+    """
+    Decide when the captcha models are worth an upgrade check, and load them once
+
+    `manifest.json` under `root` records the hcaptcha-challenger version and the
+    time of the last successful `install(upgrade=True)`. The upgrade runs again
+    only when the package version changes or `refresh_interval` has elapsed.
+    In offline mode no upgrade check is made, whatever is installed is used.
+    """
+
+    root: Path
+    refresh_interval: int = 86400
+    offline: bool = False
+    clip: bool = True
+
+    _modelhub: Any = None
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.root.joinpath("manifest.json")
+
+    def read_manifest(self) -> Dict[str, Any]:
+        try:
+            return json.loads(self.manifest_path.read_text(encoding="utf8"))
+        except (FileNotFoundError, JSONDecodeError):
+            return {}
+
+    def is_stale(self, manifest: Dict[str, Any], version: str) -> bool:
+        return (
+            manifest.get("version") != version
+            or manifest.get("clip", False) < self.clip
+            or time.time() - manifest.get("upgraded_at", 0) > self.refresh_interval
+        )
+
+    def ensure(self):
+        """Upgrade the models if the manifest says so and return the shared ModelHub"""
+        import importlib_metadata
+        from hcaptcha_challenger import install
+        from hcaptcha_challenger.onnx.modelhub import ModelHub
+
+        version = importlib_metadata.version("hcaptcha-challenger")
+        manifest = self.read_manifest()
+
+        if self.offline:
+            logger.debug("Use cached models", offline=True, version=manifest.get("version"))
+        elif self.is_stale(manifest, version):
+            start = time.perf_counter()
+            install(upgrade=True, clip=self.clip)
+            self.root.mkdir(parents=True, exist_ok=True)
+            manifest = {"version": version, "clip": self.clip, "upgraded_at": int(time.time())}
+            atomic_write_text(self.manifest_path, json.dumps(manifest, indent=2))
+            logger.info(
+                "Models upgraded", version=version, elapsed=round(time.perf_counter() - start, 2)
+            )
+
+        if self._modelhub is None:
+            modelhub = ModelHub.from_github_repo()
+            modelhub.parse_objects()
+            self._modelhub = modelhub
+
+        return self._modelhub
+
+    async def aensure(self):
+        """ensure() off the event loop, concurrent accounts wait for the first caller"""
+        async with self._lock:
+            return await asyncio.to_thread(self.ensure)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/11/24 1:12
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description:
+from __future__ import annotations
+
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Dict
+
+import httpx
+
+from utils.limits import LimitedTransport
+
+DEFAULT_HEADERS = {
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)"
+    " Chrome/115.0.0.0 Safari/537.36 Edg/115.0.1901.203"
+}
+
+_client: httpx.AsyncClient | None = None
+
+_transport: httpx.AsyncBaseTransport | None = None
+
+
+class _RejectCookiePolicy(DefaultCookiePolicy):
+    """
+    The client is shared by every account,
+    Set-Cookie from one account must never leak into the requests of another
+    """
+
+    def set_ok(self, cookie, request):
+        return False
+
+
+def cookie_header(cookies: Dict[str, str] | None) -> Dict[str, str]:
+    if not cookies:
+        return {}
+    return {"cookie": "; ".join(f"{k}={v}" for k, v in cookies.items())}
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Process-wide AsyncClient, HTTP/2 with keep-alive connections reused across accounts,
+    every request passes the per-endpoint limiter of `utils.limits`
+    """
+    global _client
+
+    if _client is None or _client.is_closed:
+        # The client ignores http2 and limits once it is given a transport
+        transport = _transport or httpx.AsyncHTTPTransport(
+            http2=True, limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+        _client = httpx.AsyncClient(
+            headers=DEFAULT_HEADERS,
+            cookies=CookieJar(policy=_RejectCookiePolicy()),
+            timeout=httpx.Timeout(15, connect=10),
+            transport=LimitedTransport(transport),
+        )
+    return _client
+
+
+def set_transport(transport: httpx.AsyncBaseTransport | None):
+    """Route the shared client through `transport`, applies to the next client created"""
+    global _transport
+    _transport = transport
+
+
+async def aclose_client():
+    global _client
+
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# Time       : 2023/11/27 21:05
+# Author     : QIN2DIM
+# GitHub     : https://github.com/QIN2DIM
+# Description:
+from __future__ import annotations
+
+import re
+from collections import Counter
+from contextlib import suppress
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Tuple, TYPE_CHECKING
+from urllib.parse import urlsplit
+
+from loguru import logger
+
+from utils.assets import CACHEABLE_TYPES, HIT_HEADER, is_immutable
+
+if TYPE_CHECKING:
+    from playwright.async_api import BrowserContext, Request, Response, Route
+
+TRACKER_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "facebook.net",
+    "facebook.com",
+    "hotjar.com",
+    "cookielaw.org",
+    "onetrust.com",
+    "tracking.epicgames.com",
+    "datarouter.ol.epicgames.com",
+    "datarouter.ol.epicgames.net",
+)
+
+NEVER_BLOCK_HOSTS = (
+    # hCaptcha frames, challenge images and the talon wrapper around them
+    "hcaptcha.com",
+    "ecosec.on.epicgames.com",
+    # webPurchaseContainer iframe
+    "payment-website-pci.ol.epicgames.com",
+)
+
+# Used when a blocked resource type was never observed in this process
+DEFAULT_SIZES = {"image": 60_000, "media": 500_000, "font": 40_000}
+
+
+def host_matches(host: str, suffixes: Tuple[str, ...]) -> bool:
+    return any(host == s or host.endswith(f".{s}") for s in suffixes)
+
+
+@dataclass(frozen=True)
+class BlockProfile:
+    """Resource types and hosts the claim flow can do without"""
+
+    name: str
+    resource_types: FrozenSet[str] = frozenset()
+    hosts: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_name(cls, name: str | None) -> BlockProfile | None:
+        return PROFILES.get((name or "off").lower())
+
+    @property
+    def host_pattern(self) -> re.Pattern:
+        """URLs on `hosts` or any of their subdomains"""
+        hosts = "|".join(re.escape(h) for h in self.hosts)
+        return re.compile(rf"^[a-z]+://([^/?#]*\.)?({hosts})(:\d+)?([/?#]|$)", re.IGNORECASE)
+
+    def should_block(self, request: Request) -> bool:
+        host = urlsplit(request.url).hostname or ""
+        if host_matches(host, NEVER_BLOCK_HOSTS) or request.is_navigation_request():
+            return False
+        # Anything inside the captcha or purchase iframes is left alone
+        with suppress(Exception):
+            if request.frame.parent_frame is not None:
+                return False
+        if host_matches(host, self.hosts):
+            return True
+        return request.resource_type in self.resource_types
+
+
+PROFILES: Dict[str, BlockProfile | None] = {
+    "off": None,
+    "trackers": BlockProfile(name="trackers", hosts=TRACKER_HOSTS),
+    "lean": BlockProfile(
+        name="lean",
+        resource_types=frozenset({"image", "media", "font"}),
+        hosts=TRACKER_HOSTS,
+    ),
+}
+
+
+@dataclass
+class RouteStats:
+    """
+    What a profile saved, and what it may have cost
+
+    While a route is registered Playwright can bypass the HTTP cache of the context,
+    the persistent profile's disk cache included. `cacheable_bytes` counts the
+    long-lived static responses that were downloaded anyway, an upper bound of that
+    cost since a cold cache would have fetched them too. `net_saved_bytes` is what is
+    left of the saving once it is paid for.
+    """
+
+    profile: str
+    requests: int = 0
+    blocked: Counter = field(default_factory=Counter)
+    blocked_hosts: Counter = field(default_factory=Counter)
+    cacheable_bytes: int = 0
+
+    _sizes: Dict[str, list] = field(default_factory=dict)
+
+    def observe(self, response: Response):
+        """Learn the typical size of each resource type from the responses let through"""
+        with suppress(KeyError, ValueError):
+            size = int(response.headers["content-length"])
+            resource_type = response.request.resource_type
+            total = self._sizes.setdefault(resource_type, [0, 0])
+            total[0] += 1
+            total[1] += size
+            if (
+                response.status == 200
+                and resource_type in CACHEABLE_TYPES
+                and HIT_HEADER not in response.headers
+                and is_immutable(response.headers)
+            ):
+                self.cacheable_bytes += size
+
+    def mean_size(self, resource_type: str) -> int:
+        if resource_type in self._sizes:
+            count, total = self._sizes[resource_type]
+            return total // max(count, 1)
+        return DEFAULT_SIZES.get(resource_type, 5_000)
+
+    @property
+    def saved_requests(self) -> int:
+        return sum(self.blocked.values())
+
+    @property
+    def saved_bytes(self) -> int:
+        """Estimated, blocked responses are never downloaded so their size is not known"""
+        return sum(self.mean_size(t) * n for t, n in self.blocked.items())
+
+    @property
+    def net_saved_bytes(self) -> int:
+        return self.saved_bytes - self.cacheable_bytes
+
+    def report(self):
+        logger.info(
+            "Route profile",
+            profile=self.profile,
+            requests=self.requests,
+            saved_requests=self.saved_requests,
+            saved_bytes_est=self.saved_bytes,
+            cacheable_bytes=self.cacheable_bytes,
+            net_saved_bytes_est=self.net_saved_bytes,
+            blocked=dict(self.blocked),
+            top_hosts=dict(self.blocked_hosts.most_common(5)),
+        )
+
+
+async def apply_block_profile(context: BrowserContext, profile: BlockProfile) -> RouteStats:
+    """
+    Abort what `profile` does not need on every page of the context
+
+    A profile of hosts only routes the URLs on those hosts, every other request goes
+    through the browser untouched. Resource types can only be told per request,
+    a profile with `resource_types` has to route everything.
+    """
+    stats = RouteStats(profile=profile.name)
+
+    async def handle(route: Route):
+        request = route.request
+        stats.requests += 1
+        if profile.should_block(request):
+            stats.blocked[request.resource_type] += 1
+            stats.blocked_hosts[urlsplit(request.url).hostname or ""] += 1
+            await route.abort("blockedbyclient")
+        else:
+            await route.fallback()
+
+    context.on("response", stats.observe)
+    await context.route("**/*" if profile.resource_types else profile.host_pattern, handle)
+
+    return stats
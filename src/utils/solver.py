@@ -3,12 +3,15 @@
 # Author     : QIN2DIM
 # GitHub     : https://github.com/QIN2DIM
 # Description:
-import asyncio
-from dataclasses import dataclass
+from __future__ import annotations
+
+from dataclasses import dataclass, fields
+from pathlib import Path
 
 from hcaptcha_challenger.agents import AgentT
 from playwright.async_api import Page
-from tenacity import *
+
+from utils.common import wait_latest
 
 
 @dataclass
@@ -32,34 +35,38 @@ class AgentG(AgentT):
 
         return frame_challenge
 
-    @retry(
-        retry=retry_if_exception_type(asyncio.QueueEmpty),
-        wait=wait_fixed(0.5),
-        stop=(stop_after_delay(30) | stop_after_attempt(60)),
-        reraise=True,
-    )
-    async def _reset_state(self) -> bool | None:
-        self.cr = None
-        self.qr = self.qr_queue.get_nowait()
+    @classmethod
+    def from_page(cls, page: Page, tmp_dir: Path | None = None, modelhub=None, **kwargs):
+        """
+        Args:
+            page:
+            tmp_dir:
+            modelhub: ModelHub shared by every solver in the process, models already
+                loaded by another account are reused instead of being initialized again
+            **kwargs: Options of the agent, e.g. self_supervised, and of
+                ModelHub.from_github_repo. With a shared modelhub the agent options
+                are still applied and only the ModelHub options are ignored
+
+        Returns:
 
-        if not self.qr_queue.empty():
-            for _ in range(self.qr_queue.qsize()):
-                self.qr = self.qr_queue.get_nowait()
+        """
+        if modelhub is None:
+            return super().from_page(page=page, tmp_dir=tmp_dir, **kwargs)
 
+        # AgentT.from_page would build and parse a ModelHub of its own first
+        agent_fields = {f.name for f in fields(cls)}
+        options = {k: v for k, v in kwargs.items() if k in agent_fields}
+        if tmp_dir and isinstance(tmp_dir, Path):
+            options["tmp_dir"] = tmp_dir
+        return cls(page=page, modelhub=modelhub, **options)
+
+    async def _reset_state(self) -> bool | None:
+        self.cr = None
+        self.qr = await wait_latest(self.qr_queue)
         return True
 
-    @retry(
-        retry=retry_if_exception_type(asyncio.QueueEmpty),
-        wait=wait_fixed(0.5),
-        stop=(stop_after_delay(30) | stop_after_attempt(60)),
-        reraise=True,
-    )
     async def _is_success(self):
-        self.cr = self.cr_queue.get_nowait()
-
-        if not self.cr_queue.empty():
-            for _ in range(self.cr_queue.qsize()):
-                self.cr = self.cr_queue.get_nowait()
+        self.cr = await wait_latest(self.cr_queue)
 
         # Match: Timeout / Loss
         if not self.cr or not self.cr.is_pass: